@@ -1,30 +1,38 @@
 #!/usr/bin/env python
-import os, subprocess, shlex, sys, tempfile, shutil, random, uuid, zipfile, json, binascii
-from Scripts import downloader, plist, run, utils
-from collections import OrderedDict
+import os, hashlib, itertools, re, struct, shlex, sys, json, binascii, threading
+# argparse, tempfile, shutil, zipfile and the Scripts modules only some
+# commands need (bincache, cache, identity, output, pool, serials, service) are
+# imported where they're used to keep startup quick - see Scripts/importtime.py
+from Scripts import downloader, lock, plist, prefix, run, utils, writer
+from collections import OrderedDict, deque
 # Import from secrets - or fall back on random.SystemRandom()
 # functions if on python 2
 try:
-    from secrets import randbits, choice
+    from secrets import randbits
     basestring = str
 except ImportError:
     from random import SystemRandom
     _sysrand = SystemRandom()
     randbits = _sysrand.getrandbits
-    choice   = _sysrand.choice
 
 class Smbios:
-    def __init__(self):
+    def __init__(self, interactive=True, answers=None):
         os.chdir(os.path.dirname(os.path.realpath(__file__)))
         self.u = utils.Utils("GenSMBIOS")
+        if answers is not None:
+            # Scripted session - see Utils.replay()
+            self.u.replay(answers)
         self.d = downloader.Downloader()
         self.r = run.Run()
         self.oc_release_url = "https://github.com/acidanthera/OpenCorePkg/releases/latest"
         self.scripts = "Scripts"
         self.plist = None
         self.plist_data = None
+        self.plist_dirty = False # Whether plist_data has diverged from the file on disk
+        self.plist_prints = None # plist.fingerprint() of the file on disk
         self.plist_type = "Unknown" # Can be "Clover" or "OpenCore" depending
-        self.remote = self._get_remote_version()
+        # Only check for updates when we're driving the menu
+        self.remote = self._get_remote_version() if interactive else None
         self.okay_keys = [
             "SerialNumber",
             "BoardSerialNumber",
@@ -33,55 +41,122 @@ class Smbios:
             "Trust",
             "Memory"
         ]
-        try: self.rom_prefixes = json.load(open(os.path.join(self.scripts,"prefix.json")))
-        except: self.rom_prefixes = []
+        # Sorted, packed OUI table compiled from prefix.json - empty if that's missing
+        self.rom_prefixes = prefix.PrefixTable(os.path.join(self.scripts,"prefix.json"))
         self.settings_file = os.path.join(self.scripts,"settings.json")
         try: self.settings = json.load(open(self.settings_file))
         except: self.settings = {}
+        # What we loaded - _save_settings() only writes back keys that differ
+        self.settings_base = json.loads(json.dumps(self.settings))
+        # Advisory locks shared by every instance - see lock.lock_for()
+        self.lock_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),self.scripts,"locks")
         self.gen_rom = True
+        # Download retry policy - see Downloader.download()
+        try:
+            self.d.retries = int(self.settings.get("download_retries",self.d.retries))
+            self.d.backoff = float(self.settings.get("download_backoff",self.d.backoff))
+        except:
+            pass
+        # Leftover macserial -a lines for every model, so no pass is wasted
+        self.smbios_buffers = {}
+        self.smbios_buffer_size = 1000
+        self.smbios_lock = threading.Lock()
+        self.split_args = {} # macserial args string -> tokens
+        self.batch_info = None # Whether macserial takes several -i/-mi at once - None until we know
+        # Top-level keys we actually read or write - anything else in the plist
+        # is skipped on load and written back untouched
+        self.plist_keys = ("PlatformInfo","SMBIOS","RtVariables","SystemParameters")
+        # Snapshots of parsed configs so reselecting an unchanged one skips parsing
+        try: cache_size = int(self.settings.get("plist_cache_size",8))
+        except: cache_size = 8
+        self.plist_cache_size = cache_size
+        # Both caches are created on first use - see the properties below
+        self._bin_cache = None
+        self._plist_cache = None
+        # Plist writes go through a temp file and os.replace - fsync policy can be
+        # "none", "file", or "full"
+        self.writer = writer.WriteBehind(fsync=self.settings.get("plist_fsync","file"),lock_dir=self.lock_dir)
+
+    @property
+    def bin_cache(self):
+        # Every platform's macserial from each release we've downloaded
+        if self._bin_cache is None:
+            from Scripts import bincache
+            self._bin_cache = bincache.BinaryCache(os.path.join(os.path.dirname(os.path.realpath(__file__)),self.scripts,"bin_cache"),lock_dir=self.lock_dir)
+        return self._bin_cache
+
+    @property
+    def plist_cache(self):
+        if self._plist_cache is None:
+            from Scripts import cache
+            self._plist_cache = cache.PlistCache(os.path.join(self.scripts,"plist_cache"),max_entries=self.plist_cache_size,lock_dir=self.lock_dir)
+        return self._plist_cache
 
     def _save_settings(self):
-        if self.settings:
-            try:
-                json.dump(self.settings,open(self.settings_file,"w"),indent=2)
-            except:
-                pass
-        elif os.path.exists(self.settings_file):
-            try:
-                os.remove(self.settings_file)
-            except:
-                pass
+        # Other instances may have saved since we loaded - so under the lock we
+        # re-read the file and apply only the keys we changed on top of it.
+        # Returns True on success.
+        try:
+            with lock.lock_for(self.settings_file,self.lock_dir):
+                try:
+                    with open(self.settings_file) as f:
+                        current = json.load(f)
+                except (IOError, OSError):
+                    # Missing - nothing to merge with
+                    current = {}
+                for key in set(self.settings) | set(self.settings_base):
+                    if (key in self.settings) == (key in self.settings_base) and self.settings.get(key) == self.settings_base.get(key):
+                        continue
+                    if key in self.settings:
+                        current[key] = self.settings[key]
+                    else:
+                        current.pop(key,None)
+                if current:
+                    writer.atomic_write(self.settings_file,json.dumps(current,indent=2).encode("utf-8"))
+                elif os.path.exists(self.settings_file):
+                    os.remove(self.settings_file)
+        except Exception as e:
+            print("Error saving {}: {}".format(self.settings_file,e))
+            return False
+        self.settings = current
+        self.settings_base = json.loads(json.dumps(current))
+        return True
 
-    def _get_macserial_version(self):
-        # Attempts to determine the macserial version from the latest OpenCorePkg
-        macserial_v = None
+    def _get_macserial_info(self):
+        # Returns a (version, url) tuple for macserial in the latest OpenCorePkg
+        # release - either can be None on failure.  The release page points us
+        # at both macserial.h and the assets list, which we then fetch at once.
+        macserial_v = url = None
         try:
             urlsource = self.d.get_string(self.oc_release_url, False)
-            for line in urlsource.split("\n"):
-                if "expanded_assets" in line:
-                    # Get the version from the URL
-                    oc_vers = line.split(' src="')[1].split('"')[0].split("/")[-1]
-                    macserial_h_url = "https://raw.githubusercontent.com/acidanthera/OpenCorePkg/{}/Utilities/macserial/macserial.h".format(oc_vers)
-                    macserial_h = self.d.get_string(macserial_h_url,False)
-                    macserial_v = macserial_h.split('#define PROGRAM_VERSION "')[1].split('"')[0]
+            assets_url = next(line.split(' src="')[1].split('"')[0] for line in urlsource.split("\n") if "expanded_assets" in line)
+        except:
+            return (None, None)
+        # Get the version from the URL
+        oc_vers = assets_url.split("/")[-1]
+        macserial_h_url = "https://raw.githubusercontent.com/acidanthera/OpenCorePkg/{}/Utilities/macserial/macserial.h".format(oc_vers)
+        (macserial_h, _), (expanded_html, _) = self.d.get_many([macserial_h_url, assets_url])
+        try:
+            macserial_v = macserial_h.split('#define PROGRAM_VERSION "')[1].split('"')[0]
         except:
             pass
-        return macserial_v
-
-    def _get_macserial_url(self):
-        # Gets a URL to the latest release of OpenCorePkg
         try:
-            urlsource = self.d.get_string(self.oc_release_url, False)
-            for line in urlsource.split("\n"):
-                if "expanded_assets" in line:
-                    expanded_html = self.d.get_string(line.split(' src="')[1].split('"')[0], False)
-                    for l in expanded_html.split("\n"):
-                        if 'href="/acidanthera/OpenCorePkg/releases/download/' in l and "-RELEASE.zip" in l:
-                            # Got it
-                            return "https://github.com{}".format(l.split('href="')[1].split('"')[0])
+            for l in expanded_html.split("\n"):
+                if 'href="/acidanthera/OpenCorePkg/releases/download/' in l and "-RELEASE.zip" in l:
+                    # Got it
+                    url = "https://github.com{}".format(l.split('href="')[1].split('"')[0])
+                    break
         except:
             pass
-        return None
+        return (macserial_v, url)
+
+    def _get_macserial_version(self):
+        # Attempts to determine the macserial version from the latest OpenCorePkg
+        return self._get_macserial_info()[0]
+
+    def _get_macserial_url(self):
+        # Gets a URL to the latest release of OpenCorePkg
+        return self._get_macserial_info()[1]
 
     def _get_binary(self,binary_name=None):
         if not binary_name:
@@ -113,51 +188,73 @@ class Smbios:
             return vers
         return None
 
-    def _download_and_extract(self, temp, url, path_in_zip=[]):
+    def _download_and_extract(self, temp, url, path_in_zip=[], version=None, install=True):
+        # Downloads the OpenCorePkg zip, files every platform's macserial into
+        # the binary cache at once, and copies them into Scripts if install
+        import tempfile, zipfile
         ztemp = tempfile.mkdtemp(dir=temp)
         zfile = os.path.basename(url)
         print("\nDownloading {}...".format(os.path.basename(url)))
-        result = self.d.stream_to_file(url, os.path.join(ztemp,zfile))
+        # Retries resume from what we already have on disk
+        result = self.d.download(url, os.path.join(ztemp,zfile))
         print("")
         if not result:
             raise Exception(" - Failed to download!")
         print(" - Extracting...")
-        btemp = tempfile.mkdtemp(dir=temp)
-        # Extract with built-in tools \o/
+        # Only pull the macserial builds out of the zip
+        zip_prefix = "".join(x+"/" for x in path_in_zip)
         with zipfile.ZipFile(os.path.join(ztemp,zfile)) as z:
-            z.extractall(os.path.join(temp,btemp))
+            members = [x for x in z.namelist() if x.startswith(zip_prefix) and not "/" in x[len(zip_prefix):] and "macserial" in x[len(zip_prefix):].lower()]
+        if not members:
+            raise Exception(" - No macserial binaries found!")
+        entries = self.bin_cache.add_from_zip(os.path.join(ztemp,zfile), members, version or os.path.splitext(zfile)[0])
+        if install:
+            self._install_binaries(entries)
+        return entries
+
+    def _install_binaries(self, entries):
+        # Copies cached binaries into the Scripts directory, where _get_binary()
+        # looks for them.  Each one is swapped in whole, so other instances
+        # never run a partial binary, and installs are serialized so they
+        # don't interleave versions.
         script_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),self.scripts)
-        search_path = os.path.join(temp,btemp)
-        # Extend the search path if path_in_zip contains elements
-        if path_in_zip: search_path = os.path.join(search_path,*path_in_zip)
-        for x in os.listdir(search_path):
-            if "macserial" in x.lower():
+        if not os.path.exists(script_dir):
+            os.mkdir(script_dir)
+        with lock.lock_for(os.path.join(script_dir,"macserial"),self.lock_dir):
+            for e in entries:
                 # Found one
-                print(" - Found {}".format(x))
-                if os.name != "nt":
-                    print("   - Chmod +x...")
-                    self.r.run({"args":["chmod","+x",os.path.join(search_path,x)]})
+                print(" - Found {} ({} {})".format(e["name"],e["os"],e["arch"]))
                 print("   - Copying to {} directory...".format(self.scripts))
-                if not os.path.exists(script_dir):
-                    os.mkdir(script_dir)
-                shutil.copy(os.path.join(search_path,x), os.path.join(script_dir,x))
+                source = os.path.join(self.bin_cache.root,e["path"])
+                with open(source,"rb") as f:
+                    data = f.read()
+                # Bring the executable bit along from the cache
+                writer.atomic_write(os.path.join(script_dir,e["name"]),data,mode=os.stat(source).st_mode & 0o7777)
 
     def _get_macserial(self):
         # Download both the windows and mac versions of macserial and expand them to the Scripts dir
         self.u.head("Getting MacSerial")
         print("")
         print("Gathering latest macserial info...")
-        url = self._get_macserial_url()
+        vers, url = self._get_macserial_info()
+        if vers: self.remote = vers
         path_in_zip = ["Utilities","macserial"]
+        if vers and self.bin_cache.has_version(vers):
+            # Already fetched this release - no need to download it again
+            print(" - v{} is in the binary cache".format(vers))
+            self._install_binaries(self.bin_cache.entries(version=vers))
+            self.u.grab("\nDone.",timeout=5)
+            return
         if not url:
             print("Error checking for updates (network issue)\n")
             self.u.grab("Press [enter] to return...")
             return
+        import tempfile, shutil
         temp = tempfile.mkdtemp()
         cwd  = os.getcwd()
         try:
             print(" - {}".format(url))
-            self._download_and_extract(temp,url,path_in_zip)
+            self._download_and_extract(temp,url,path_in_zip,vers)
         except Exception as e:
             print("We ran into some problems :(\n\n{}".format(e))
         print("\nCleaning up...")
@@ -166,6 +263,45 @@ class Smbios:
         self.u.grab("\nDone.",timeout=5)
         return
 
+    def _binaries_command(self, args):
+        # Backs the binaries subcommand - returns an exit code
+        from Scripts import bincache
+        if args.action == "list":
+            for e in self.bin_cache.entries():
+                print("{:<8} {:<10} {:<10} {:<18} {:,} bytes".format(e["os"],e["arch"],e["version"],e["name"],e["size"]))
+            return 0
+        elif args.action == "fetch":
+            vers, url = self._get_macserial_info()
+            if vers and self.bin_cache.has_version(vers):
+                print("macserial v{} is already cached".format(vers))
+                return 0
+            if not url:
+                print("Error checking for updates (network issue)")
+                return 1
+            import tempfile, shutil
+            temp = tempfile.mkdtemp()
+            try:
+                entries = self._download_and_extract(temp,url,["Utilities","macserial"],vers,install=False)
+            except Exception as e:
+                print(e)
+                return 1
+            finally:
+                shutil.rmtree(temp,ignore_errors=True)
+            for e in entries:
+                print(" - Cached {} ({} {}) v{}".format(e["name"],e["os"],e["arch"],e["version"]))
+            return 0
+        import shutil
+        host_os, host_arch = bincache.host_target()
+        path = self.bin_cache.get(args.os or host_os, args.arch or host_arch, args.version)
+        if not path:
+            print("No cached macserial for {} {}{}".format(args.os or host_os, args.arch or host_arch, " v"+args.version if args.version else ""))
+            return 1
+        if not os.path.isdir(args.dest):
+            os.makedirs(args.dest)
+        shutil.copy(path, os.path.join(args.dest,os.path.basename(path)))
+        print(os.path.join(args.dest,os.path.basename(path)))
+        return 0
+
     def _get_remote_version(self):
         self.u.head("Getting MacSerial Remote Version")
         print("")
@@ -174,149 +310,476 @@ class Smbios:
         vers = self._get_macserial_version()
         if not vers:
             print("Error checking for updates (network issue)\n")
-            self.u.grab("Press [enter] to return...")
+            if self.u.answers is None:
+                # Don't eat a scripted answer that's only asked for offline
+                self.u.grab("Press [enter] to return...")
             return None
         return vers
 
     def _get_plist(self):
-        self.u.head("Select Plist")
-        print("")
-        print("Current: {}".format(self.plist))
-        print("Type:    {}".format(self.plist_type))
-        print("")
-        print("C. Clear Selection")
-        print("M. Main Menu")
-        print("Q. Quit")
-        print("")
-        p = self.u.grab("Please drag and drop the target plist:  ")
-        if p.lower() == "q":
-            self.u.custom_quit()
-        elif p.lower() == "m":
-            return
-        elif p.lower() == "c":
-            self.plist = None
-            self.plist_data = None
-            return
-        
-        pc = self.u.check_path(p)
-        if not pc:
-            self.u.head("File Missing")
-            print("")
-            print("Plist file not found:\n\n{}".format(p))
+        while True:
+            self.u.head("Select Plist")
             print("")
-            self.u.grab("Press [enter] to return...")
-            return self._get_plist()
-        try:
-            with open(pc, "rb") as f:
-                self.plist_data = plist.load(f,dict_type=OrderedDict)
-        except Exception as e:
-            self.u.head("Plist Malformed")
+            print("Current: {}".format(self.plist))
+            print("Type:    {}".format(self.plist_type))
             print("")
-            print("Plist file malformed:\n\n{}".format(e))
+            print("C. Clear Selection")
+            print("M. Main Menu")
+            print("Q. Quit")
             print("")
-            self.u.grab("Press [enter] to return...")
-            return self._get_plist()
-        # Got a valid plist - let's try to check for Clover or OC structure
-        detected_type = "OpenCore" if "PlatformInfo" in self.plist_data else "Clover" if "SMBIOS" in self.plist_data else "Unknown"
-        if detected_type.lower() == "unknown":
-            # Have the user decide which to do
-            while True:
-                self.u.head("Unknown Plist Type")
+            p = self.u.grab("Please drag and drop the target plist:  ")
+            if p.lower() == "q":
+                self.u.custom_quit()
+            elif p.lower() == "m":
+                return
+            elif p.lower() == "c":
+                self.plist = None
+                self.plist_data = None
+                return
+        
+            pc = self.u.check_path(p)
+            if not pc:
+                self.u.head("File Missing")
                 print("")
-                print("Could not auto-determine plist type!")
+                print("Plist file not found:\n\n{}".format(p))
                 print("")
-                print("1. Clover")
-                print("2. OpenCore")
+                self.u.grab("Press [enter] to return...")
+                continue
+            try:
+                # The cache checks mtime and size before hashing anything, and
+                # keeps the type detection and Clover key check alongside the
+                # parsed data so a hit skips those too
+                snapshot = self.plist_cache.get(pc)
+                if not isinstance(snapshot,dict) or sorted(snapshot) != ["clover","plist","type"]:
+                    # Load from the file itself so the subtrees we don't need
+                    # are never read into memory - they stay as byte ranges
+                    key = self.plist_cache.key(pc)
+                    with open(pc, "rb") as f:
+                        data = plist.load(f,dict_type=OrderedDict,keys=self.plist_keys,lazy_data=True)
+                    detected = "OpenCore" if "PlatformInfo" in data else "Clover" if "SMBIOS" in data else "Unknown"
+                    snapshot = {"plist":data,"type":detected,"clover":self._clover_check(data) if detected == "Clover" else None}
+                    self.plist_cache.put(pc,snapshot,key)
+                self.plist_data = snapshot["plist"]
+                self.plist_dirty = False
+                # Content hashes of what's on disk - lets _save_plist() skip
+                # writes that wouldn't change anything
+                self.plist_prints = plist.fingerprint(self.plist_data)
+            except Exception as e:
+                self.u.head("Plist Malformed")
                 print("")
-                print("M. Return to the Menu")
+                print("Plist file malformed:\n\n{}".format(e))
                 print("")
-                t = self.u.grab("Please select the target type:  ").lower()
-                if t == "m": return self._get_plist()
-                elif t in ("1","2"):
-                    detected_type = "Clover" if t == "1" else "OpenCore"
-                    break
-        # Got a plist and type - let's save it
-        self.plist_type = detected_type
-        # Apply any key-stripping or safety checks
-        if self.plist_type.lower() == "clover":
-            # Got a valid clover plist - let's check keys
-            key_check = self.plist_data.get("SMBIOS",{})
-            new_smbios = {}
-            removed_keys = []
-            for key in key_check:
-                if key not in self.okay_keys:
-                    removed_keys.append(key)
-                else:
-                    # Build our new SMBIOS
-                    new_smbios[key] = key_check[key]
-            # We want the SmUUID to be the top-level - remove CustomUUID if exists
-            if "CustomUUID" in self.plist_data.get("SystemParameters",{}):
-                removed_keys.append("CustomUUID")
-            if len(removed_keys):
+                self.u.grab("Press [enter] to return...")
+                continue
+            # Got a valid plist - let's try to check for Clover or OC structure
+            detected_type = snapshot["type"]
+            if detected_type.lower() == "unknown":
+                # Have the user decide which to do
                 while True:
-                    self.u.head("")
+                    self.u.head("Unknown Plist Type")
+                    print("")
+                    print("Could not auto-determine plist type!")
+                    print("")
+                    print("1. Clover")
+                    print("2. OpenCore")
                     print("")
-                    print("The following keys will be removed:\n\n{}\n".format(", ".join(removed_keys)))
-                    con = self.u.grab("Continue? (y/n):  ")
-                    if con.lower() == "y":
-                        # Flush settings
-                        self.plist_data["SMBIOS"] = new_smbios
-                        # Remove the CustomUUID if present
-                        self.plist_data.get("SystemParameters",{}).pop("CustomUUID", None)
+                    print("M. Return to the Menu")
+                    print("")
+                    t = self.u.grab("Please select the target type:  ").lower()
+                    if t == "m":
+                        detected_type = None
+                        break
+                    elif t in ("1","2"):
+                        detected_type = "Clover" if t == "1" else "OpenCore"
                         break
-                    elif con.lower() == "n":
-                        self.plist_data = None
-                        return
-        self.plist = pc
+            if detected_type is None:
+                # Back to plist selection
+                continue
+            # Got a plist and type - let's save it
+            self.plist_type = detected_type
+            # Apply any key-stripping or safety checks
+            if self.plist_type.lower() == "clover":
+                # Got a valid clover plist - let's check keys
+                new_smbios, removed_keys = snapshot["clover"] or self._clover_check(self.plist_data)
+                if len(removed_keys):
+                    while True:
+                        self.u.head("")
+                        print("")
+                        print("The following keys will be removed:\n\n{}\n".format(", ".join(removed_keys)))
+                        con = self.u.grab("Continue? (y/n):  ")
+                        if con.lower() == "y":
+                            # Flush settings
+                            self.plist_data["SMBIOS"] = new_smbios
+                            # Remove the CustomUUID if present
+                            self.plist_data.get("SystemParameters",{}).pop("CustomUUID", None)
+                            self.plist_dirty = True
+                            break
+                        elif con.lower() == "n":
+                            self.plist_data = None
+                            return
+            self.plist = pc
+            return
+
+    def _clover_check(self, data):
+        # Returns a (new SMBIOS dict, removed keys) tuple - only the okay_keys
+        # are kept, and the SmUUID should be the top-level, so any CustomUUID
+        # goes too
+        key_check = data.get("SMBIOS",{})
+        new_smbios = {}
+        removed_keys = []
+        for key in key_check:
+            if key not in self.okay_keys:
+                removed_keys.append(key)
+            else:
+                # Build our new SMBIOS
+                new_smbios[key] = key_check[key]
+        if "CustomUUID" in data.get("SystemParameters",{}):
+            removed_keys.append("CustomUUID")
+        return (new_smbios, removed_keys)
 
     def _get_rom(self):
         # Generate 6-bytes of cryptographically random values
         rom_str = "{:x}".format(randbits(8*6)).upper().rjust(12,"0")
         if self.rom_prefixes:
-            # Replace the prefix with one from our list
-            prefix = choice(self.rom_prefixes)
-            if isinstance(prefix,basestring):
-                rom_str = prefix+rom_str[len(prefix):]
+            # Replace the prefix with one from our table
+            oui = self.rom_prefixes.choice()
+            rom_str = oui+rom_str[len(oui):]
         return rom_str
 
-    def _get_smbios(self, macserial, smbios_type, times=1):
-        # Returns a list of SMBIOS lines that match
-        total = []
-        # Get any additional args and ensure they're a string
-        args = self.settings.get("macserial_args")
+    def _get_uuids(self, count):
+        # Draws all the entropy for count UUIDs in one go and formats them as
+        # uppercase version 4 UUIDs
+        h = binascii.hexlify(os.urandom(16*count)).decode("utf-8").upper()
+        return ["{}-{}-4{}-{}{}-{}".format(
+            h[i:i+8],
+            h[i+8:i+12],
+            h[i+13:i+16],
+            "89AB"[int(h[i+16],16) & 0x3], # RFC 4122 variant
+            h[i+17:i+20],
+            h[i+20:i+32]
+        ) for i in range(0,len(h),32)]
+
+    def _get_uuid_bytes(self, count):
+        # Raw form of _get_uuids() - count*16 bytes with the version 4 and
+        # RFC 4122 variant bits set
+        raw = bytearray(os.urandom(16*count))
+        for i in range(6,len(raw),16):
+            raw[i] = (raw[i] & 0x0F) | 0x40
+            raw[i+2] = (raw[i+2] & 0x3F) | 0x80
+        return bytes(raw)
+
+    def _get_roms(self, count):
+        # Batched _get_rom() - the prefix indexes come from one block of 32-bit
+        # values (the modulo bias is negligible for a few hundred prefixes)
+        if not self.rom_prefixes:
+            h = binascii.hexlify(os.urandom(6*count)).decode("utf-8").upper()
+            return [h[i:i+12] for i in range(0,len(h),12)]
+        h = binascii.hexlify(os.urandom(3*count)).decode("utf-8").upper()
+        total = len(self.rom_prefixes)
+        indexes = struct.unpack(">{}L".format(count),os.urandom(4*count))
+        return [self.rom_prefixes[x % total]+h[i*6:i*6+6] for i,x in enumerate(indexes)]
+
+    def _bulk_generate(self, kind, count, path=None, fmt="text", batch=65536):
+        # Streams count UUIDs or ROMs to path (stdout if None) in batches
+        from Scripts import output
+        gen = self._get_uuids if kind == "uuid" else self._get_roms
+        w = output.RecordWriter(output.open_output(path),[kind],fmt)
+        try:
+            while w.count < count:
+                w.write_many((x,) for x in gen(min(batch,count-w.count)))
+        finally:
+            w.close()
+        return w.count
+
+    def _bulk_menu(self):
+        from Scripts import output
+        while True:
+            self.u.head("Bulk UUID/ROM Generation")
+            print("")
+            print("1. UUIDs")
+            print("2. {} ROMs".format("Apple" if self.rom_prefixes else "Random"))
+            print("")
+            print("M. Main Menu")
+            print("Q. Quit")
+            print("")
+            kind = self.u.grab("Please select what to generate:  ").lower()
+            if kind == "m":
+                return
+            elif kind == "q":
+                self.u.custom_quit()
+            elif not kind in ("1","2"):
+                continue
+            kind = "uuid" if kind == "1" else "rom"
+            count = self.u.grab("How many?  ")
+            try:
+                count = int(count)
+                assert count > 0
+            except:
+                continue
+            path = self.u.grab("Output file path (blank for the screen):  ").strip()
+            fmt = "text"
+            if path:
+                path = os.path.abspath(os.path.expanduser(path.strip("\"'")))
+                fmt = self.u.grab("Format - text, csv, or json [text]:  ").lower().strip() or "text"
+                if not fmt in output.FORMATS: fmt = "text"
+            self.u.head("Bulk {} Generation".format(kind.upper()))
+            print("")
+            try:
+                total = self._bulk_generate(kind, count, path or None, fmt)
+                if path: print("Wrote {:,} {}(s) to {}".format(total,kind.upper(),path))
+            except Exception as e:
+                print("Failed to generate:\n\n{}".format(e))
+            print("")
+            self.u.grab("Press [enter] to return...")
+            return
+
+    def _macserial_args(self, profile=None):
+        # Returns the tokenized extra arguments for profile - a name from the
+        # macserial_profiles setting, or None for macserial_args.  Profiles can
+        # be stored as a string or an already-split list.  Each string is only
+        # split once.
+        if profile is None:
+            args = self.settings.get("macserial_args")
+        else:
+            profiles = self.settings.get("macserial_profiles",{})
+            if not isinstance(profiles,dict) or not profile in profiles:
+                raise KeyError("Unknown macserial profile: {}".format(profile))
+            args = profiles[profile]
+        if isinstance(args,list):
+            return tuple(str(x) for x in args)
         if not isinstance(args,basestring): args = ""
-        while len(total) < times:
-            total_len = len(total)
-            smbios, err, code = self.r.run({"args":[macserial,"-a"]+shlex.split(args)})
-            if code != 0:
+        if not args in self.split_args:
+            self.split_args[args] = tuple(shlex.split(args))
+        return self.split_args[args]
+
+    def _harvest_smbios(self, macserial, args=()):
+        # Runs macserial -a once with the extra tokenized args and files every
+        # model's line into our per-model buffers for those args.  Returns the
+        # set of models seen, or None on error.
+        from Scripts import serials
+        smbios, err, code = self.r.run({"args":[macserial,"-a"]+list(args),"raw":True})
+        if code != 0:
+            # Issues generating
+            return None
+        seen = set()
+        with self.smbios_lock:
+            for record in serials.parse_smbios(smbios):
+                key = (args,record[0].lower())
+                if not key in seen:
+                    seen.add(key)
+                    if not key in self.smbios_buffers:
+                        # Surplus beyond this is dropped oldest first
+                        self.smbios_buffers[key] = deque(maxlen=self.smbios_buffer_size)
+                self.smbios_buffers[key].append(record)
+        return set(model for _, model in seen)
+
+    def _get_models(self, macserial, wants, args=None):
+        # Takes a dict of {model:count} and returns {model:[lines]} of raw
+        # macserial (model, serial, board serial) lines - sharing each -a pass
+        # between every model asked for, and keeping the surplus for later.
+        # args are the tokenized extra arguments (default: macserial_args), and
+        # lines made with different args are never mixed.  Models macserial
+        # doesn't produce get False, and None is returned if macserial errors
+        # out.
+        if args is None:
+            args = self._macserial_args()
+        got = OrderedDict((m,[]) for m in wants)
+        while True:
+            with self.smbios_lock:
+                for model, lines in got.items():
+                    if lines is False: continue
+                    buf = self.smbios_buffers.get((args,model.lower()))
+                    while buf and len(lines) < wants[model]:
+                        lines.append(buf.popleft())
+            short = [m for m, lines in got.items() if lines is not False and len(lines) < wants[m]]
+            if not short:
+                return got
+            seen = self._harvest_smbios(macserial, args)
+            if seen is None:
+                return None
+            for model in short:
+                if not model.lower() in seen:
+                    # Nothing new for this one - it's not coming
+                    got[model] = False
+
+    def _get_smbios(self, macserial, smbios_type, times=1, args=None, chunk=10000):
+        # Returns an IdentityBatch of SMBIOS records that match - large counts
+        # are generated chunk at a time and packed as they come in, so only one
+        # chunk's worth of strings is ever alive at once
+        from Scripts import identity
+        batch = identity.IdentityBatch()
+        for done in range(0,times,chunk):
+            total = self._get_models(macserial, {smbios_type:min(chunk,times-done)}, args)
+            if total is None:
                 # Issues generating
                 return None
-            # Got our text, let's see if the SMBIOS exists
-            for line in smbios.split("\n"):
-                line = line.strip()
-                try:
-                    line_smbios = line.split()[0]
-                    assert line_smbios != "ERROR:"
-                except:
+            if not total[smbios_type]:
+                return total[smbios_type]
+            self._format_smbios(total[smbios_type], batch)
+        return batch
+
+    def _batch_profiles(self, macserial, jobs, profiles, path=None, fmt="text", batch=20, workers=4):
+        # Generates the {model:count} jobs once per profile, running profiles
+        # concurrently, and streams the records to path (stdout if None) with
+        # the profile name in front.  profiles maps names to tokenized args.
+        # Returns the number written, None on a macserial error, or False if a
+        # model wasn't generated.
+        from multiprocessing.pool import ThreadPool
+        from Scripts import output, pool
+        # Split each profile's work into batch-sized pieces so output streams
+        tasks = []
+        for name, args in profiles.items():
+            for model, count in jobs.items():
+                for done in range(0,count,batch):
+                    tasks.append((name,args,model,min(batch,count-done)))
+        def run(task):
+            name, args, model, count = task
+            lines = self._get_models(macserial,{model:count},args)
+            return (name, model, None if lines is None else self._format_smbios(lines[model]))
+        w = output.RecordWriter(output.open_output(path),("profile",)+tuple(x[0] for x in pool.FIELDS),fmt)
+        threads = ThreadPool(max(1,min(workers,len(profiles))))
+        try:
+            for name, model, records in threads.imap_unordered(run,tasks):
+                if not records:
+                    sys.stderr.write("Error - {} for profile {}\n".format("macserial returned an error" if records is None else model+" not generated by macserial",name))
+                    return records
+                w.write_many((name,)+tuple(r) for r in records)
+        finally:
+            threads.terminate()
+            threads.join()
+            w.close()
+        return w.count
+
+    def _format_smbios(self, total, batch=None):
+        # Adds a UUID and ROM to each (model, serial, board serial) line and
+        # packs them into batch (a new IdentityBatch if None) - the values are
+        # kept as raw bytes and only formatted when records are read back out
+        from Scripts import identity
+        if not total:
+            return total
+        if batch is None:
+            batch = identity.IdentityBatch()
+        batch.extend_generated(total, self._get_uuid_bytes(len(total)), binascii.unhexlify("".join(self._get_roms(len(total)))))
+        return batch
+
+    def _parse_jobs(self, text, default=1):
+        # Turns "iMac19,1 x500, MacPro7,1 x200" into an OrderedDict of
+        # {model:count} - models without a count get default
+        jobs = OrderedDict()
+        for model, count in re.findall(r"([A-Za-z]+\d+,\d+)(?:\s*x\s*(\d+))?", text):
+            jobs[model] = jobs.get(model,0)+(int(count) if count else default)
+        return jobs
+
+    def _fill_pool(self, macserial, jobs, pool_path, batch=20):
+        # Generates complete identities for each {model:count} in jobs and
+        # appends them to the pool in batches, so an interrupted fill keeps what
+        # it already made.  Models share macserial passes.
+        from Scripts import identity, pool
+        p = pool.IdentityPool(pool_path)
+        try:
+            done = OrderedDict((m,0) for m in jobs)
+            count = sum(jobs.values())
+            while sum(done.values()) < count:
+                wants = OrderedDict((m,min(batch,jobs[m]-done[m])) for m in jobs if done[m] < jobs[m])
+                smbios = self._get_models(macserial,wants)
+                if smbios is None:
+                    # macserial error
+                    return None
+                missing = [m for m, lines in smbios.items() if lines is False]
+                if missing:
+                    print("Error - {} not generated by macserial".format(", ".join(missing)))
+                    return False
+                records = identity.IdentityBatch()
+                for model, lines in smbios.items():
+                    self._format_smbios(lines, records)
+                    done[model] += len(lines)
+                total = p.fill(records)
+                print("{:,}/{:,} generated ({:,} in pool)".format(sum(done.values()),count,total))
+            return sum(done.values())
+        finally:
+            p.close()
+
+    def _serve(self, macserial, host="127.0.0.1", port=8765, socket_path=None, models=(), buffer_size=100):
+        # Keeps our state warm and serves identities from a prefilled buffer
+        from Scripts import service
+        buf = service.IdentityBuffer(lambda model, count: self._get_smbios(macserial,model,count), size=buffer_size, models=models)
+        service.serve({"buffer":buf,"uuids":self._get_uuids,"roms":self._get_roms}, host=host, port=port, socket_path=socket_path)
+
+    def _macserial_info(self, macserial, flag, identifiers):
+        # Returns a parse_info() dict (or None on failure) per identifier, in
+        # order.  Asks for them all in one macserial run, and falls back on a
+        # run each - remembering that for next time - if the output doesn't
+        # split into one block per identifier.
+        from Scripts import serials
+        if len(identifiers) > 1 and self.batch_info is not False:
+            args = [macserial]
+            for x in identifiers:
+                args.extend((flag,x))
+            out, err, code = self.r.run({"args":args})
+            blocks = serials.parse_info_blocks(out) if code == 0 else []
+            if len(blocks) == len(identifiers):
+                self.batch_info = True
+                return blocks
+            self.batch_info = False
+        infos = []
+        for x in identifiers:
+            out, err, code = self.r.run({"args":[macserial,flag,x]})
+            infos.append(serials.parse_info(out) if code == 0 else None)
+        return infos
+
+    def _decode_block(self, macserial, identifiers, kind=None):
+        # Decodes the date/plant fields natively, and only asks macserial for
+        # what it alone knows (the model) about the identifiers that look sane -
+        # each distinct one once, in a single run per kind where possible
+        from Scripts import serials
+        infos = [serials.decode(x, kind) for x in identifiers]
+        if not macserial:
+            return infos
+        for flag, want in (("-i","serial"),("-mi","mlb")):
+            todo = OrderedDict()
+            for info in infos:
+                if info["valid"] and info["kind"] == want:
+                    todo.setdefault(info["identifier"],[]).append(info)
+            if not todo:
+                continue
+            for ident, fields in zip(todo, self._macserial_info(macserial, flag, list(todo))):
+                if fields is None:
                     continue
-                if line_smbios.lower() == smbios_type.lower():
-                    total.append(line)
-                    if len(total) >= times:
-                        break
-            if total_len == len(total):
-                # Total didn't change - return False
-                return False
-        # Have a list now - let's format it
-        output = []
-        for sm in total:
-            s_list = [x.strip() for x in sm.split("|")]
-            # Add a uuid
-            s_list.append(str(uuid.uuid4()).upper())
-            # Generate a ROM value
-            s_list.append(self._get_rom())
-            # Format the text
-            output.append(s_list)
-        return output
+                for info in todo[ident]:
+                    info["model"] = fields.get("model","").split(" - ")[-1].strip() or None
+                    serials.resolve_year(info, fields.get("year"))
+                    if fields.get("valid","").lower() in ("no","invalid"):
+                        info["valid"] = False
+                        info["error"] = "rejected by macserial"
+        return infos
+
+    def _decode_identifiers(self, macserial, lines, path=None, fmt="text", kind=None, jobs=4, chunk=256):
+        # Streams decoded records for each non-empty line in lines to path
+        # (stdout if None) - chunk lines at a time, split across up to jobs
+        # macserial processes.  Pass macserial=None to decode natively only.
+        from multiprocessing.pool import ThreadPool
+        from Scripts import output, serials
+        w = output.RecordWriter(output.open_output(path),serials.FIELDS,fmt)
+        jobs = max(1,jobs)
+        workers = ThreadPool(jobs) if macserial and jobs > 1 else None
+        identifiers = (x.strip() for x in lines if x.strip())
+        try:
+            while True:
+                block = list(itertools.islice(identifiers,chunk))
+                if not block:
+                    break
+                if workers:
+                    size = -(-len(block)//jobs)
+                    infos = [i for part in workers.map(lambda x: self._decode_block(macserial,x,kind),[block[i:i+size] for i in range(0,len(block),size)]) for i in part]
+                else:
+                    infos = self._decode_block(macserial,block,kind)
+                w.write_many([tuple(i[f] for f in serials.FIELDS) for i in infos])
+        finally:
+            if workers:
+                workers.close()
+                workers.join()
+            w.close()
+        return w.count
 
     def _generate_smbios(self, macserial):
         if not macserial or not os.path.exists(macserial):
@@ -332,34 +795,35 @@ class Smbios:
                 print("")
                 self.u.grab("Press [enter] to return...")
                 return
-        self.u.head("Generate SMBIOS")
-        print("")
-        print("M. Main Menu")
-        print("Q. Quit")
-        print("")
-        print("Please type the SMBIOS to gen and the number")
-        menu = self.u.grab("of times to generate [max 20] (i.e. iMac18,3 5):  ")
-        if menu.lower() == "q":
-            self.u.custom_quit()
-        elif menu.lower() == "m":
-            return
-        menu = menu.split(" ")
-        if len(menu) == 1:
-            # Default of one time
-            smtype = menu[0]
-            times  = 1
-        else:
-            smtype = menu[0]
-            try:
-                times  = int(menu[1])
-            except:
-                self.u.head("Incorrect Input")
-                print("")
-                print("Incorrect format - must be SMBIOS times - i.e. iMac18,3 5")
-                print("")
-                self.u.grab("Press [enter] to return...")
-                self._generate_smbios(macserial)
+        while True:
+            self.u.head("Generate SMBIOS")
+            print("")
+            print("M. Main Menu")
+            print("Q. Quit")
+            print("")
+            print("Please type the SMBIOS to gen and the number")
+            menu = self.u.grab("of times to generate [max 20] (i.e. iMac18,3 5):  ")
+            if menu.lower() == "q":
+                self.u.custom_quit()
+            elif menu.lower() == "m":
                 return
+            menu = menu.split(" ")
+            if len(menu) == 1:
+                # Default of one time
+                smtype = menu[0]
+                times  = 1
+            else:
+                smtype = menu[0]
+                try:
+                    times  = int(menu[1])
+                except:
+                    self.u.head("Incorrect Input")
+                    print("")
+                    print("Incorrect format - must be SMBIOS times - i.e. iMac18,3 5")
+                    print("")
+                    self.u.grab("Press [enter] to return...")
+                    continue
+            break
         # Keep it between 1 and 20
         if times < 1:
             times = 1
@@ -390,36 +854,92 @@ class Smbios:
                 print("\nFlushing first SMBIOS entry to {}".format(self.plist))
             else:
                 print("\nFlushing SMBIOS entry to {}".format(self.plist))
+            # Gather our changes as path -> value so we can try patching them
+            # into the file in place before falling back on a full dump
+            changes = OrderedDict()
             if self.plist_type.lower() == "clover":
                 # Ensure plist data exists
                 for x in ["SMBIOS","RtVariables","SystemParameters"]:
                     if not x in self.plist_data:
                         self.plist_data[x] = {}
-                self.plist_data["SMBIOS"]["ProductName"] = smbios[0][0]
-                self.plist_data["SMBIOS"]["SerialNumber"] = smbios[0][1]
-                self.plist_data["SMBIOS"]["BoardSerialNumber"] = smbios[0][2]
-                self.plist_data["RtVariables"]["MLB"] = smbios[0][2]
-                self.plist_data["SMBIOS"]["SmUUID"] = smbios[0][3]
+                changes[("SMBIOS","ProductName")] = smbios[0][0]
+                changes[("SMBIOS","SerialNumber")] = smbios[0][1]
+                changes[("SMBIOS","BoardSerialNumber")] = smbios[0][2]
+                changes[("RtVariables","MLB")] = smbios[0][2]
+                changes[("SMBIOS","SmUUID")] = smbios[0][3]
                 if self.gen_rom:
-                    self.plist_data["RtVariables"]["ROM"] = plist.wrap_data(binascii.unhexlify(smbios[0][4].encode("utf-8")))
-                self.plist_data["SystemParameters"]["InjectSystemID"] = True
+                    changes[("RtVariables","ROM")] = plist.wrap_data(binascii.unhexlify(smbios[0][4].encode("utf-8")))
+                changes[("SystemParameters","InjectSystemID")] = True
             elif self.plist_type.lower() == "opencore":
                 # Ensure data exists
                 if not "PlatformInfo" in self.plist_data: self.plist_data["PlatformInfo"] = {}
                 if not "Generic" in self.plist_data["PlatformInfo"]: self.plist_data["PlatformInfo"]["Generic"] = {}
                 # Set the values
-                self.plist_data["PlatformInfo"]["Generic"]["SystemProductName"] = smbios[0][0]
-                self.plist_data["PlatformInfo"]["Generic"]["SystemSerialNumber"] = smbios[0][1]
-                self.plist_data["PlatformInfo"]["Generic"]["MLB"] = smbios[0][2]
-                self.plist_data["PlatformInfo"]["Generic"]["SystemUUID"] = smbios[0][3]
+                changes[("PlatformInfo","Generic","SystemProductName")] = smbios[0][0]
+                changes[("PlatformInfo","Generic","SystemSerialNumber")] = smbios[0][1]
+                changes[("PlatformInfo","Generic","MLB")] = smbios[0][2]
+                changes[("PlatformInfo","Generic","SystemUUID")] = smbios[0][3]
                 if self.gen_rom:
-                    self.plist_data["PlatformInfo"]["Generic"]["ROM"] = plist.wrap_data(binascii.unhexlify(smbios[0][4].encode("utf-8")))
-            with open(self.plist, "wb") as f:
-                plist.dump(self.plist_data, f, sort_keys=False)
+                    changes[("PlatformInfo","Generic","ROM")] = plist.wrap_data(binascii.unhexlify(smbios[0][4].encode("utf-8")))
+            for path, value in changes.items():
+                target = self.plist_data
+                for key in path[:-1]:
+                    target = target[key]
+                target[path[-1]] = value
+            if not self._save_plist(changes):
+                print(" - Values already match - nothing written")
             # Got only valid keys now
         print("")
         self.u.grab("Press [enter] to return...")
 
+    def _save_plist(self, changes=None, flush=True):
+        # Queue our edits and write them out atomically right away.  Only a
+        # single bulk run should pass flush=False to coalesce several saves -
+        # and it must call _flush_plist() itself before returning to the menu.
+        # Returns False if the data still matches what's on disk and nothing
+        # needed writing.
+        if not self.plist_dirty and self._matches_disk(changes):
+            # Anything queued earlier has been undone
+            self.writer.discard(self.plist)
+            return False
+        self.writer.queue(self.plist, self.plist_data, changes, dirty=self.plist_dirty)
+        self.plist_dirty = False
+        if flush:
+            self._flush_plist()
+        return True
+
+    def _matches_disk(self, changes=None):
+        # Compares the top-level subtrees the changes touch (or everything if
+        # there are none) against the fingerprints of what's on disk
+        if self.plist_prints is None:
+            return False
+        if not changes:
+            return plist.fingerprint(self.plist_data) == self.plist_prints
+        for key in set(path[0] for path in changes):
+            on_disk = self.plist_prints.get((key,))
+            if (on_disk is None) != (key not in self.plist_data):
+                return False
+            if on_disk is not None and plist.fingerprint(self.plist_data[key]) != on_disk:
+                return False
+        return True
+
+    def _flush_plist(self):
+        # Writes anything queued for the current plist - returns whether it did.
+        # Write errors are raised to the caller.
+        if not self.plist or not os.path.abspath(self.plist) in self.writer.pending:
+            return False
+        # Binary plists are loaded with the parts we don't touch left mapped -
+        # pull those in first, Windows won't replace a file that's mapped
+        plist.close(self.plist_data)
+        self.writer.flush(self.plist)
+        # Patched writes keep whatever else is in the file - including other
+        # instances' edits - so take our data and fingerprints from what
+        # actually landed on disk
+        with open(self.plist, "rb") as f:
+            self.plist_data = plist.load(f,dict_type=OrderedDict,keys=self.plist_keys,lazy_data=True)
+        self.plist_prints = plist.fingerprint(self.plist_data)
+        return True
+
     def _list_current(self, macserial):
         if not macserial or not os.path.exists(macserial):
             self.u.head("Missing MacSerial")
@@ -467,10 +987,12 @@ class Smbios:
                 self.u.custom_quit()
             elif args.lower() == "c":
                 self.settings.pop("macserial_args",None)
-                self._save_settings()
+                if not self._save_settings():
+                    self.u.grab("Press [enter] to return...")
             else:
                 self.settings["macserial_args"] = args
-                self._save_settings()
+                if not self._save_settings():
+                    self.u.grab("Press [enter] to return...")
 
     def main(self):
         self.u.head()
@@ -498,6 +1020,7 @@ class Smbios:
         args = self.settings.get("macserial_args")
         if not args or not isinstance(args,basestring): args = None
         print("8. Additional Args (Currently: {})".format(args))
+        print("9. Bulk Generate UUIDs/ROMs")
         print("")
         print("Q. Quit")
         print("")
@@ -515,7 +1038,7 @@ class Smbios:
         elif menu == "4":
             self.u.head("Generated UUID")
             print("")
-            print(str(uuid.uuid4()).upper())
+            print(self._get_uuids(1)[0])
             print("")
             self.u.grab("Press [enter] to return...")
         elif menu == "5":
@@ -530,15 +1053,192 @@ class Smbios:
             self.gen_rom = not self.gen_rom
         elif menu == "8":
             self.get_additional_args()
+        elif menu == "9":
+            self._bulk_menu()
 
-if __name__ == "__main__":
-    s = Smbios()
+def _get_parser():
+    import argparse
+    from Scripts import output
+    parser = argparse.ArgumentParser(description="Generate SMBIOS info with macserial - run without arguments for the interactive menu.")
+    sub = parser.add_subparsers(dest="command")
+    bulk = sub.add_parser("bulk", help="generate UUIDs or ROMs in bulk")
+    bulk.add_argument("kind", choices=("uuid","rom"), help="what to generate")
+    bulk.add_argument("-n", "--count", type=int, default=1, help="how many to generate")
+    bulk.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    bulk.add_argument("-f", "--format", choices=output.FORMATS, default="text", help="output format")
+    pool_cmd = sub.add_parser("pool", help="fill or check out from a precomputed identity pool")
+    pool_cmd.add_argument("action", choices=("fill","checkout","status"))
+    pool_cmd.add_argument("model", nargs="?", help="SMBIOS to generate when filling - one model, or a job like \"iMac19,1 x500, MacPro7,1 x200\"")
+    pool_cmd.add_argument("-n", "--count", type=int, default=1, help="how many identities to generate (per model without an xN count) or check out")
+    pool_cmd.add_argument("-p", "--pool", default=os.path.join(os.path.dirname(os.path.realpath(__file__)),"Scripts","identities.pool"), help="pool file path")
+    pool_cmd.add_argument("-o", "--output", help="file to write checked out identities to (default: stdout)")
+    pool_cmd.add_argument("-f", "--format", choices=output.FORMATS, default="text", help="output format")
+    serve = sub.add_parser("serve", help="serve identities over localhost HTTP or a Unix socket")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    serve.add_argument("--socket", help="serve HTTP over this Unix socket path instead")
+    serve.add_argument("--models", nargs="*", default=[], help="models to prefill (i.e. iMac19,1 MacPro7,1)")
+    serve.add_argument("--buffer", type=int, default=100, help="identities to keep ready per model")
+    batch = sub.add_parser("batch", help="generate identities once per macserial argument profile, tagged by profile")
+    batch.add_argument("job", help="models to generate - i.e. \"iMac19,1 x500, MacPro7,1 x200\"")
+    batch.add_argument("-p", "--profiles", nargs="+", default=["default"], help="profile names from the macserial_profiles setting, or NAME=ARGS for one-off profiles (default uses macserial_args)")
+    batch.add_argument("-n", "--count", type=int, default=1, help="how many of each model without an xN count")
+    batch.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    batch.add_argument("-f", "--format", choices=output.FORMATS, default="text", help="output format")
+    batch.add_argument("-j", "--jobs", type=int, default=4, help="profiles to run at once (default: 4)")
+    diff = sub.add_parser("diff", help="list the key paths that differ between two plists")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    prints = sub.add_parser("fingerprint", help="print a content hash for each plist - identical configs hash the same")
+    prints.add_argument("plists", nargs="+")
+    prints.add_argument("-k", "--key", action="append", default=[], help="hash just this top-level key (repeatable)")
+    menu = sub.add_parser("menu", help="run the interactive menu, answering prompts from a file first")
+    menu.add_argument("-a", "--answers", help="file with one answer per prompt (- for stdin) - the keyboard takes over when it runs out")
+    binaries = sub.add_parser("binaries", help="manage the cache of macserial builds for every platform")
+    binaries.add_argument("action", choices=("list","fetch","export"), help="list the cache, fetch the latest release into it, or export a build")
+    binaries.add_argument("--os", choices=("macos","linux","windows"), help="platform to export (default: this one)")
+    binaries.add_argument("--arch", help="architecture to export - x86_64, arm64, or x86 (default: this one)")
+    binaries.add_argument("--version", help="macserial version to export (default: newest cached)")
+    binaries.add_argument("-d", "--dest", default=".", help="folder to export to (default: current folder)")
+    decode = sub.add_parser("decode", help="decode and validate serials/MLBs read from a file or stdin")
+    decode.add_argument("input", nargs="?", default="-", help="file with one serial or MLB per line (default: stdin)")
+    decode.add_argument("-k", "--kind", choices=("serial","mlb"), help="treat every line as this kind (default: guess from length)")
+    decode.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    decode.add_argument("-f", "--format", choices=output.FORMATS, default="text", help="output format")
+    decode.add_argument("-j", "--jobs", type=int, default=4, help="macserial processes to run at once (default: 4)")
+    decode.add_argument("--native", action="store_true", help="skip macserial - no model lookup, but much faster")
+    return parser
+
+def _load_fingerprint(path):
+    with open(path,"rb") as f:
+        return plist.fingerprint(plist.load(f,dict_type=OrderedDict,lazy_data=True))
+
+def _plist_command(args):
+    # diff and fingerprint - these never need an Smbios instance
+    if args.command == "diff":
+        old, new = _load_fingerprint(args.old), _load_fingerprint(args.new)
+        for path in plist.changed_paths(old, new):
+            print(" -> ".join(str(x) for x in path) or "(root)")
+        return 0 if old == new else 1
+    code = 0
+    for path in args.plists:
+        try:
+            prints = _load_fingerprint(path)
+        except Exception as e:
+            sys.stderr.write("{}: {}\n".format(path,e))
+            code = 1
+            continue
+        if args.key:
+            # Hash of just the chosen subtrees
+            nodes = [prints.get((k,)) for k in args.key]
+            digest = binascii.hexlify(hashlib.sha1(b"".join(n.digest if n else b"-" for n in nodes)).digest()).decode("ascii")
+        else:
+            digest = prints.hexdigest()
+        print("{}  {}".format(digest,path))
+    return code
+
+def _run_command(args):
+    from Scripts import output, pool
+    # Resolve paths before Smbios() changes our working directory
+    if getattr(args,"output",None) not in (None,"-"):
+        args.output = os.path.abspath(args.output)
+    if getattr(args,"pool",None):
+        args.pool = os.path.abspath(args.pool)
+    if getattr(args,"socket",None):
+        args.socket = os.path.abspath(args.socket)
+    if getattr(args,"input",None) not in (None,"-"):
+        args.input = os.path.abspath(args.input)
+    if getattr(args,"dest",None):
+        args.dest = os.path.abspath(args.dest)
+    if getattr(args,"answers",None) not in (None,"-"):
+        args.answers = os.path.abspath(args.answers)
+    if args.command == "menu":
+        _run_menu(args.answers)
+    elif args.command in ("diff","fingerprint"):
+        return _plist_command(args)
+    s = Smbios(interactive=False)
+    if args.command == "bulk":
+        s._bulk_generate(args.kind, max(0,args.count), args.output, args.format)
+    elif args.command == "pool":
+        if args.action == "fill":
+            macserial = s._get_binary()
+            jobs = s._parse_jobs(args.model or "", max(0,args.count))
+            if not jobs or not macserial:
+                print("A model and the macserial binary are required to fill the pool.")
+                return 1
+            result = s._fill_pool(macserial, jobs, args.pool)
+            if result is None:
+                print("Error - macserial returned an error!")
+                return 1
+            elif result is False:
+                return 1
+        elif args.action == "checkout":
+            p = pool.IdentityPool(args.pool)
+            try: identities = p.checkout(max(0,args.count))
+            finally: p.close()
+            w = output.RecordWriter(output.open_output(args.output),[x[0] for x in pool.FIELDS],args.format)
+            w.write_many(identities)
+            w.close()
+            if len(identities) < args.count:
+                sys.stderr.write("Pool exhausted - only {:,} of {:,} identities available\n".format(len(identities),args.count))
+                return 1
+        else:
+            p = pool.IdentityPool(args.pool)
+            try: cursor, count = p.status()
+            finally: p.close()
+            print("{:,} identities total, {:,} checked out, {:,} available".format(count,cursor,count-cursor))
+    elif args.command == "serve":
+        macserial = s._get_binary()
+        if not macserial:
+            print("MacSerial binary not found.")
+            return 1
+        s._serve(macserial, args.host, args.port, args.socket, args.models, max(1,args.buffer))
+    elif args.command == "batch":
+        macserial = s._get_binary()
+        jobs = s._parse_jobs(args.job, max(0,args.count))
+        if not jobs or not macserial:
+            print("A model and the macserial binary are required.")
+            return 1
+        profiles = OrderedDict()
+        try:
+            for p in args.profiles:
+                if "=" in p:
+                    name, p_args = p.split("=",1)
+                    profiles[name] = tuple(shlex.split(p_args))
+                else:
+                    profiles[p] = s._macserial_args(None if p == "default" and not p in s.settings.get("macserial_profiles",{}) else p)
+        except KeyError as e:
+            print(e.args[0])
+            return 1
+        result = s._batch_profiles(macserial, jobs, profiles, args.output, args.format, workers=args.jobs)
+        if not result:
+            return 1
+    elif args.command == "binaries":
+        return s._binaries_command(args)
+    elif args.command == "decode":
+        macserial = None if args.native else s._get_binary()
+        if not args.native and not macserial:
+            sys.stderr.write("MacSerial binary not found - decoding natively without models.\n")
+        f = sys.stdin if args.input == "-" else open(args.input)
+        try:
+            s._decode_identifiers(macserial, f, args.output, args.format, args.kind, args.jobs)
+        finally:
+            if f is not sys.stdin: f.close()
+    return 0
+
+def _run_menu(answers=None):
+    if answers is None and not sys.stdin.isatty():
+        # Piped in - treat it as a script of answers
+        answers = "-"
+    s = Smbios(answers=answers)
     while True:
         try:
             s.main()
         except Exception as e:
             print(e)
-            if sys.version_info >= (3, 0):
-                input("Press [enter] to return...")
-            else:
-                raw_input("Press [enter] to return...")
+            s.u.grab("Press [enter] to return...")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(_run_command(_get_parser().parse_args()))
+    _run_menu()
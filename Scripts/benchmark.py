@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+# Synthetic config.plist corpus generator and plist.py benchmark suite.
+#
+# Run from the repo root:
+#
+#   python -m Scripts.benchmark --sizes 10K,1M,10M --out results.json
+#   python -m Scripts.benchmark --generate corpus_dir --sizes 1M
+#   python -m Scripts.benchmark --compare old.json new.json
+#   python -m Scripts.benchmark --macserial 1000000
+#
+# Configs are generated deterministically from --seed, so results from
+# different commits are timing the exact same input.
+import os, re, sys, json, time, binascii, random, platform, subprocess, argparse, tempfile, shutil, gc, datetime, plistlib
+from collections import OrderedDict
+from Scripts import plist, serials
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 - no peak memory tracking
+    tracemalloc = None
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+FLAVORS = ("opencore","clover")
+FORMATS = ("xml","binary")
+# Top-level keys GenSMBIOS actually reads - used for the selective load timings
+SMBIOS_KEYS = ("PlatformInfo","SMBIOS","RtVariables","SystemParameters")
+
+def parse_size(value):
+    # Takes a string like 10K, 1.5M, or 2048 and returns the number of bytes
+    value = str(value).strip().upper().rstrip("B")
+    mult = 1
+    for suffix, m in (("K",1024),("M",1024**2),("G",1024**3)):
+        if value.endswith(suffix):
+            value, mult = value[:-1], m
+            break
+    return int(float(value)*mult)
+
+###                ###
+# Corpus Generation #
+###                ###
+
+def _blob(rng, size):
+    if not size:
+        return plist.wrap_data(b"")
+    return plist.wrap_data(binascii.unhexlify("{:0{}x}".format(rng.getrandbits(8*size),size*2)))
+
+def _hex_name(rng, length=8):
+    return "".join(rng.choice("0123456789ABCDEF") for _ in range(length))
+
+def _serial(rng, length):
+    return "".join(rng.choice("0123456789ABCDEFGHJKLMNPQRSTUVWXYZ") for _ in range(length))
+
+def _opencore_base(rng):
+    config = OrderedDict()
+    config["ACPI"] = OrderedDict([("Add",[]),("Delete",[]),("Patch",[]),("Quirks",OrderedDict([("FadtEnableReset",False),("NormalizeHeaders",False),("RebaseRegions",False),("ResetHwSig",False),("ResetLogoStatus",True),("SyncTableIds",False)]))])
+    config["Booter"] = OrderedDict([("MmioWhitelist",[]),("Patch",[]),("Quirks",OrderedDict([("AvoidRuntimeDefrag",True),("DevirtualiseMmio",False),("ProvideMaxSlide",0),("SetupVirtualMap",True)]))])
+    config["DeviceProperties"] = OrderedDict([("Add",OrderedDict()),("Delete",OrderedDict())])
+    config["Kernel"] = OrderedDict([("Add",[]),("Block",[]),("Emulate",OrderedDict([("Cpuid1Data",_blob(rng,16)),("Cpuid1Mask",_blob(rng,16))])),("Force",[]),("Patch",[]),("Quirks",OrderedDict([("AppleCpuPmCfgLock",False),("DisableIoMapper",True),("PanicNoKextDump",True),("PowerTimeoutKernelPanic",True)]))])
+    config["Misc"] = OrderedDict([("Boot",OrderedDict([("HideAuxiliary",True),("PickerMode","External"),("Timeout",5)])),("Debug",OrderedDict([("Target",3),("DisplayLevel",2147483650)])),("Security",OrderedDict([("ScanPolicy",0),("SecureBootModel","Default"),("Vault","Optional")]))])
+    config["NVRAM"] = OrderedDict([("Add",OrderedDict([
+        ("4D1EDE05-38C7-4A6A-9CC6-4BCCA8B38C14",OrderedDict([("DefaultBackgroundColor",_blob(rng,4))])),
+        ("7C436110-AB2A-4BBB-A880-FE41995C9F82",OrderedDict([("boot-args","-v keepsyms=1"),("csr-active-config",_blob(rng,4)),("prev-lang:kbd",_blob(rng,5))]))
+    ])),("Delete",OrderedDict()),("WriteFlash",True)])
+    config["PlatformInfo"] = OrderedDict([("Automatic",True),("Generic",OrderedDict([
+        ("AdviseFeatures",False),
+        ("MLB",_serial(rng,17)),
+        ("MaxBIOSVersion",False),
+        ("ProcessorType",0),
+        ("ROM",_blob(rng,6)),
+        ("SpoofVendor",True),
+        ("SystemMemoryStatus","Auto"),
+        ("SystemProductName","iMac19,1"),
+        ("SystemSerialNumber",_serial(rng,12)),
+        ("SystemUUID","00000000-0000-0000-0000-000000000000")
+    ])),("UpdateDataHub",True),("UpdateNVRAM",True),("UpdateSMBIOS",True),("UpdateSMBIOSMode","Create")])
+    config["UEFI"] = OrderedDict([("ConnectDrivers",True),("Drivers",[]),("Quirks",OrderedDict([("ReleaseUsbOwnership",False),("RequestBootVarRouting",True)]))])
+    return config
+
+def _opencore_entry(rng, config, blob_size):
+    # Adds one chunk of realistic bulk to the config and returns it
+    pick = rng.randint(0,4)
+    if pick == 0:
+        entry = OrderedDict([("Comment","SSDT-{}".format(_hex_name(rng,4))),("Enabled",True),("Path","SSDT-{}.aml".format(_hex_name(rng,4)))])
+        config["ACPI"]["Add"].append(entry)
+    elif pick == 1:
+        entry = OrderedDict([("Base",""),("BaseSkip",0),("Comment","Rename {}".format(_hex_name(rng,4))),("Count",0),("Enabled",True),("Find",_blob(rng,blob_size)),("Limit",0),("Mask",plist.wrap_data(b"")),("OemTableId",_blob(rng,8)),("Replace",_blob(rng,blob_size)),("ReplaceMask",plist.wrap_data(b"")),("Skip",0),("TableLength",0),("TableSignature",_blob(rng,4))])
+        config["ACPI"]["Patch"].append(entry)
+    elif pick == 2:
+        entry = OrderedDict([("AAPL,ig-platform-id",_blob(rng,4)),("device-id",_blob(rng,4)),("framebuffer-patch-enable",_blob(rng,4)),("model","Device {}".format(_hex_name(rng,4))),("edid",_blob(rng,blob_size))])
+        config["DeviceProperties"]["Add"]["PciRoot(0x0)/Pci(0x{:x},0x{:x})/Pci(0x0,0x0)".format(rng.randint(0,31),rng.randint(0,7))] = entry
+    elif pick == 3:
+        entry = OrderedDict([("Arch","x86_64"),("BundlePath","{}.kext".format(_hex_name(rng,6))),("Comment",""),("Enabled",True),("ExecutablePath","Contents/MacOS/{}".format(_hex_name(rng,6))),("MaxKernel",""),("MinKernel",""),("PlistPath","Contents/Info.plist")])
+        config["Kernel"]["Add"].append(entry)
+    else:
+        entry = OrderedDict([("Arch","x86_64"),("Base","_{}".format(_hex_name(rng,10).lower())),("Comment","Patch {}".format(_hex_name(rng,4))),("Count",1),("Enabled",True),("Find",_blob(rng,blob_size)),("Identifier","kernel"),("Limit",0),("Mask",plist.wrap_data(b"")),("MaxKernel",""),("MinKernel","20.0.0"),("Replace",_blob(rng,blob_size)),("ReplaceMask",plist.wrap_data(b"")),("Skip",0)])
+        config["Kernel"]["Patch"].append(entry)
+    return entry
+
+def _clover_base(rng):
+    config = OrderedDict()
+    config["ACPI"] = OrderedDict([("DSDT",OrderedDict([("Fixes",OrderedDict([("FixHPET",True),("FixIPIC",True)])),("Patches",[])])),("DropTables",[])])
+    config["Boot"] = OrderedDict([("Arguments","-v"),("DefaultVolume","LastBootedVolume"),("Timeout",5)])
+    config["Devices"] = OrderedDict([("Properties",OrderedDict()),("USB",OrderedDict([("FixOwnership",True)]))])
+    config["GUI"] = OrderedDict([("Theme","embedded"),("ScreenResolution","1920x1080")])
+    config["KernelAndKextPatches"] = OrderedDict([("KernelPm",True),("KextsToPatch",[])])
+    config["RtVariables"] = OrderedDict([("BooterConfig","0x28"),("CsrActiveConfig","0x67"),("MLB",_serial(rng,17)),("ROM",_blob(rng,6))])
+    config["SMBIOS"] = OrderedDict([("BoardSerialNumber",_serial(rng,17)),("ProductName","iMac19,1"),("SerialNumber",_serial(rng,12)),("SmUUID","00000000-0000-0000-0000-000000000000"),("Trust",True)])
+    config["SystemParameters"] = OrderedDict([("InjectKexts","Detect"),("InjectSystemID",True)])
+    return config
+
+def _clover_entry(rng, config, blob_size):
+    pick = rng.randint(0,2)
+    if pick == 0:
+        entry = OrderedDict([("Comment","Rename {}".format(_hex_name(rng,4))),("Disabled",False),("Find",_blob(rng,blob_size)),("Replace",_blob(rng,blob_size))])
+        config["ACPI"]["DSDT"]["Patches"].append(entry)
+    elif pick == 1:
+        entry = OrderedDict([("AAPL,ig-platform-id",_blob(rng,4)),("device-id",_blob(rng,4)),("model","Device {}".format(_hex_name(rng,4))),("edid",_blob(rng,blob_size))])
+        config["Devices"]["Properties"]["PciRoot(0x0)/Pci(0x{:x},0x{:x})".format(rng.randint(0,31),rng.randint(0,7))] = entry
+    else:
+        entry = OrderedDict([("Comment","Patch {}".format(_hex_name(rng,4))),("Count",1),("Disabled",False),("Find",_blob(rng,blob_size)),("InfoPlistPatch",False),("Name","com.apple.{}".format(_hex_name(rng,6).lower())),("Replace",_blob(rng,blob_size))])
+        config["KernelAndKextPatches"]["KextsToPatch"].append(entry)
+    return entry
+
+def generate_config(flavor="opencore", size=10240, seed=0):
+    # Returns an OrderedDict config of the passed flavor that dumps to roughly
+    # size bytes of XML.  The same flavor/size/seed always gives the same config.
+    if not flavor in FLAVORS:
+        raise ValueError("Unknown flavor: {}".format(flavor))
+    rng = random.Random("{}-{}-{}".format(flavor,size,seed))
+    config = _opencore_base(rng) if flavor == "opencore" else _clover_base(rng)
+    add_entry = _opencore_entry if flavor == "opencore" else _clover_entry
+    # Larger configs get bigger blobs so we hit the target in a sane number of entries
+    max_blob = max(16,min(65536,size//256))
+    total = len(plist.dumps(config,sort_keys=False))
+    while total < size:
+        entry = add_entry(rng, config, rng.randint(4,max_blob))
+        # Each entry is nested ~3 levels deep - account for the extra tabs
+        entry_xml = plist.dumps(entry,sort_keys=False)
+        total += len(entry_xml) + 3*entry_xml.count("\n")
+    return config
+
+_INTEGER = re.compile(br"<integer>(\d+)</integer>")
+
+def _hex_integers(data):
+    # Hand-edited configs often have <integer>0x...</integer> values, which
+    # our parser accepts but never writes - swap every other integer for its
+    # hex form so both paths get timed
+    count = [0]
+    def swap(m):
+        count[0] += 1
+        if not count[0] % 2:
+            return m.group(0)
+        return "<integer>0x{:X}</integer>".format(int(m.group(1))).encode("ascii")
+    return _INTEGER.sub(swap, data)
+
+def write_corpus(folder, sizes, flavors=FLAVORS, formats=FORMATS, seed=0):
+    # Writes a config for each flavor/size/format combo and returns a list of
+    # (path, flavor, size, format) tuples
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    paths = []
+    for flavor in flavors:
+        for size in sizes:
+            config = generate_config(flavor, size, seed)
+            for fmt in formats:
+                path = os.path.join(folder,"{}-{}.{}.plist".format(flavor,size,fmt))
+                if fmt == "xml":
+                    data = _hex_integers(plist.dumps(config, sort_keys=False).encode("utf-8"))
+                else:
+                    data = plist.dumps(config, fmt=plist.FMT_BINARY, sort_keys=False)
+                with open(path,"wb") as f:
+                    f.write(data)
+                paths.append((path,flavor,size,fmt))
+    return paths
+
+###          ###
+# Benchmarking #
+###          ###
+
+def _time(func, repeat):
+    # Returns a list of wall times for repeat calls of func
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = timer()
+        func()
+        times.append(timer()-start)
+    return times
+
+def _peak(func):
+    # Returns the peak traced memory in bytes for one call of func
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def check_binary_writer(path):
+    # Our binary writer has to match plistlib byte-for-byte - raises
+    # ValueError if it doesn't for either key order
+    with open(path,"rb") as f:
+        value = plist.load(f, dict_type=OrderedDict)
+    for sort_keys in (True, False):
+        ours = plist.dumps(value, fmt=plist.FMT_BINARY, sort_keys=sort_keys)
+        theirs = plistlib.dumps(value, fmt=plistlib.FMT_BINARY, sort_keys=sort_keys)
+        if ours != theirs:
+            raise ValueError("Binary writer output differs from plistlib for {} (sort_keys={})".format(os.path.basename(path),sort_keys))
+
+# Below this, fixed costs drown out the parsing we skip
+SELECTIVE_MIN_SIZE = 1024**2
+
+def check_selective(results):
+    # A selective load has to beat a full load of the same file on both time
+    # and peak memory - raises ValueError if it doesn't.  results is the list
+    # of case results for one file.
+    cases = dict((r["case"],r) for r in results)
+    full, selective = cases.get("load"), cases.get("load_selective")
+    if not full or not selective or full["file_size"] < SELECTIVE_MIN_SIZE:
+        return
+    name = "{} {} {}".format(full["flavor"],_format_size(full["file_size"]),full["format"])
+    if selective["median"] >= full["median"]:
+        raise ValueError("Selective load is no faster than a full load for {} ({:.4f}s vs {:.4f}s)".format(name,selective["median"],full["median"]))
+    if selective["peak_memory"] is not None and full["peak_memory"] is not None and selective["peak_memory"] >= full["peak_memory"]:
+        raise ValueError("Selective load peaks no lower than a full load for {} ({} vs {})".format(name,_format_size(selective["peak_memory"]),_format_size(full["peak_memory"])))
+
+def _cases(path, fmt):
+    # Returns an OrderedDict of case name -> callable for the plist at path
+    with open(path,"rb") as f:
+        raw = f.read()
+    fmt_const = plist.FMT_XML if fmt == "xml" else plist.FMT_BINARY
+    value = plist.loads(raw, dict_type=OrderedDict)
+    out_path = path+".out"
+    def load():
+        with open(path,"rb") as f:
+            plist.load(f, dict_type=OrderedDict)
+    def load_selective():
+        with open(path,"rb") as f:
+            plist.load(f, dict_type=OrderedDict, keys=SMBIOS_KEYS, lazy_data=True)
+    def dump():
+        with open(out_path,"wb") as f:
+            plist.dump(value, f, fmt=fmt_const, sort_keys=False)
+    cases = OrderedDict()
+    cases["load"] = load
+    cases["load_selective"] = load_selective
+    cases["loads"] = lambda: plist.loads(raw, dict_type=OrderedDict)
+    cases["dump"] = dump
+    cases["dumps"] = lambda: plist.dumps(value, fmt=fmt_const, sort_keys=False)
+    if fmt == "binary" and hasattr(plistlib,"FMT_BINARY"):
+        # Baseline for the binary writer, which should match it byte-for-byte
+        cases["stdlib_dumps"] = lambda: plistlib.dumps(value, fmt=plistlib.FMT_BINARY, sort_keys=False)
+    return cases
+
+def generate_macserial_dump(lines, seed=0):
+    # Returns bytes shaped like macserial -a output - padded model names, an
+    # ERROR: line now and then, and CRLF line endings like the Windows build
+    rand = random.Random(seed)
+    chars = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+    models = ["{}{},{}".format(m,a,b) for m in ("iMac","MacBookPro","Macmini","MacPro") for a in range(1,21) for b in range(1,4)]
+    out = []
+    for i in range(lines):
+        if i % 100 == 99:
+            out.append("ERROR: Failed to generate serial for {}".format(rand.choice(models)))
+            continue
+        out.append("{:<14} | C02{} | C02{}".format(
+            models[i % len(models)],
+            "".join(rand.choice(chars) for _ in range(9)),
+            "".join(rand.choice(chars) for _ in range(14))
+        ))
+    return ("\r\n".join(out)+"\r\n").encode("utf-8")
+
+def _parse_smbios_text(data):
+    # The text parser _get_smbios() used before serials.parse_smbios() - kept
+    # as the baseline
+    total = []
+    for line in data.decode("utf-8").split("\n"):
+        line = line.strip()
+        try:
+            line_smbios = line.split()[0]
+            assert line_smbios != "ERROR:"
+        except:
+            continue
+        total.append(line)
+    return [[x.strip() for x in sm.split("|")] for sm in total]
+
+def run_macserial_benchmarks(lines, repeat=5, seed=0, verbose=True):
+    # Times serials.parse_smbios() against the old text parser on a synthetic
+    # -a dump and returns the results as a JSON-able dict
+    data = generate_macserial_dump(lines, seed)
+    records = len(serials.parse_smbios(data))
+    results = []
+    for name, func in (("parse_smbios",serials.parse_smbios),("text_baseline",_parse_smbios_text)):
+        times = _time(lambda: func(data), repeat)
+        median = sorted(times)[len(times)//2]
+        results.append(OrderedDict([
+            ("case",name),
+            ("lines",lines),
+            ("records",records),
+            ("min",min(times)),
+            ("median",median),
+            ("lines_per_second",lines/median if median else None)
+        ]))
+        if verbose:
+            print("{:<14} {:>10,} lines  median {:>8.4f}s  {:>12,.0f} lines/s".format(name, lines, median, lines/median if median else 0))
+    return OrderedDict([
+        ("commit",_git_commit()),
+        ("timestamp",datetime.datetime.now().isoformat()),
+        ("python",platform.python_version()),
+        ("repeat",repeat),
+        ("seed",seed),
+        ("results",results)
+    ])
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except Exception:
+        return None
+
+def run_benchmarks(sizes, flavors=FLAVORS, formats=FORMATS, repeat=5, seed=0, memory=True, verbose=True):
+    # Runs every case against a freshly generated corpus and returns the results
+    # as a JSON-able dict
+    temp = tempfile.mkdtemp()
+    results = []
+    try:
+        for path, flavor, size, fmt in write_corpus(temp, sizes, flavors, formats, seed):
+            file_size = os.path.getsize(path)
+            if fmt == "binary" and hasattr(plistlib,"FMT_BINARY"):
+                # No point timing output that's wrong
+                check_binary_writer(path)
+            file_results = []
+            for name, func in _cases(path, fmt).items():
+                times = _time(func, repeat)
+                result = OrderedDict([
+                    ("flavor",flavor),
+                    ("target_size",int(size)),
+                    ("file_size",file_size),
+                    ("format",fmt),
+                    ("case",name),
+                    ("min",min(times)),
+                    ("median",sorted(times)[len(times)//2]),
+                    ("peak_memory",_peak(func) if memory else None)
+                ])
+                results.append(result)
+                file_results.append(result)
+                if verbose:
+                    print("{:<9} {:>10} {:<6} {:<15} min {:>9.4f}s  median {:>9.4f}s  peak {}".format(
+                        flavor, _format_size(file_size), fmt, name, result["min"], result["median"],
+                        _format_size(result["peak_memory"]) if result["peak_memory"] is not None else "n/a"
+                    ))
+            check_selective(file_results)
+    finally:
+        shutil.rmtree(temp,ignore_errors=True)
+    return OrderedDict([
+        ("commit",_git_commit()),
+        ("timestamp",datetime.datetime.now().isoformat()),
+        ("python",platform.python_version()),
+        ("platform",platform.platform()),
+        ("repeat",repeat),
+        ("seed",seed),
+        ("results",results)
+    ])
+
+def _format_size(size):
+    for unit in ("B","KB","MB","GB"):
+        if size < 1024 or unit == "GB":
+            return "{:.1f}{}".format(size,unit) if unit != "B" else "{}B".format(size)
+        size /= 1024.0
+
+def compare(old, new):
+    # Prints the median time and peak memory ratios of new vs old results
+    key = lambda r: (r["flavor"],r["target_size"],r["format"],r["case"])
+    old_results = dict((key(r),r) for r in old["results"])
+    print("Comparing {} -> {}".format(old.get("commit"),new.get("commit")))
+    for r in new["results"]:
+        o = old_results.get(key(r))
+        if not o:
+            continue
+        time_ratio = r["median"]/o["median"] if o["median"] else float("inf")
+        mem = ""
+        if r.get("peak_memory") and o.get("peak_memory"):
+            mem = "  memory x{:.2f}".format(float(r["peak_memory"])/o["peak_memory"])
+        print("{:<9} {:>10} {:<6} {:<15} time x{:.2f}{}".format(r["flavor"],_format_size(r["file_size"]),r["format"],r["case"],time_ratio,mem))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic configs and benchmark Scripts/plist.py")
+    parser.add_argument("--sizes", default="10K,1M,10M", help="comma-separated target config sizes (i.e. 10K,1M,25M)")
+    parser.add_argument("--flavors", default=",".join(FLAVORS), help="comma-separated config flavors")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma-separated plist formats")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument("--no-memory", action="store_true", help="skip peak memory tracking")
+    parser.add_argument("--out", help="write JSON results to this path")
+    parser.add_argument("--generate", metavar="DIR", help="just write the corpus to DIR and exit")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD","NEW"), help="compare two JSON result files")
+    parser.add_argument("--macserial", type=int, metavar="LINES", help="benchmark macserial -a output parsing on a dump this many lines long instead")
+    args = parser.parse_args(argv)
+    if args.macserial:
+        results = run_macserial_benchmarks(args.macserial, args.repeat, args.seed)
+        if args.out:
+            with open(args.out,"w") as f:
+                json.dump(results,f,indent=2)
+            print("Results written to {}".format(args.out))
+        return
+    if args.compare:
+        compare(json.load(open(args.compare[0])),json.load(open(args.compare[1])))
+        return
+    sizes = [parse_size(x) for x in args.sizes.split(",") if x.strip()]
+    flavors = [x.strip() for x in args.flavors.split(",") if x.strip()]
+    formats = [x.strip() for x in args.formats.split(",") if x.strip()]
+    if args.generate:
+        for path, _, _, _ in write_corpus(args.generate, sizes, flavors, formats, args.seed):
+            print("{} ({})".format(path,_format_size(os.path.getsize(path))))
+        return
+    try:
+        results = run_benchmarks(sizes, flavors, formats, args.repeat, args.seed, not args.no_memory)
+    except ValueError as e:
+        print("Error - {}".format(e))
+        return 1
+    if args.out:
+        with open(args.out,"w") as f:
+            json.dump(results,f,indent=2)
+        print("Results written to {}".format(args.out))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import os, sys, json, struct, hashlib
+from Scripts import lock, writer
+
+# Shared store of macserial builds for every platform, so provisioning for one
+# OS from another never needs another download.  Layout:
+#
+#   <root>/index.json
+#   <root>/<version>/<os>-<arch>/<binary name>
+#
+# The index maps "os/arch/version" to an entry dict with the os, arch,
+# version, name, path (relative to root), size, and sha256 of each binary.
+INDEX = "index.json"
+
+# Header machine/cpu type values -> arch
+_MACHO_CPUS = {0x01000007:"x86_64", 0x0100000c:"arm64", 7:"x86"}
+_ELF_MACHINES = {0x3e:"x86_64", 0xb7:"arm64", 3:"x86"}
+_PE_MACHINES = {0x8664:"x86_64", 0xaa64:"arm64", 0x14c:"x86"}
+
+def identify(data):
+    # Returns an (os, arch) tuple from an executable's headers, or None if it's
+    # not a Mach-O, ELF or PE binary.  Mach-O files with more than one
+    # architecture are "universal".
+    if data[:4] == b"\xca\xfe\xba\xbe":
+        # Fat Mach-O - big endian count, then 20-byte arch entries
+        count = struct.unpack_from(">L", data, 4)[0]
+        archs = set(_MACHO_CPUS.get(struct.unpack_from(">L", data, 8+i*20)[0],"unknown") for i in range(count))
+        return ("macos", archs.pop() if len(archs) == 1 else "universal")
+    if data[:4] in (b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe"):
+        return ("macos", _MACHO_CPUS.get(struct.unpack_from("<L", data, 4)[0],"unknown"))
+    if data[:4] == b"\x7fELF":
+        endian = "<" if data[5:6] == b"\x01" else ">"
+        return ("linux", _ELF_MACHINES.get(struct.unpack_from(endian+"H", data, 18)[0],"unknown"))
+    if data[:2] == b"MZ":
+        offset = struct.unpack_from("<L", data, 0x3c)[0]
+        if data[offset:offset+4] == b"PE\x00\x00":
+            return ("windows", _PE_MACHINES.get(struct.unpack_from("<H", data, offset+4)[0],"unknown"))
+    return None
+
+def host_target():
+    # Returns the (os, arch) tuple for the machine we're running on
+    import platform
+    os_name = "windows" if os.name == "nt" else "macos" if sys.platform == "darwin" else "linux"
+    machine = platform.machine().lower()
+    arch = "x86_64" if machine in ("x86_64","amd64") else "arm64" if machine in ("arm64","aarch64") else "x86" if machine in ("i386","i686","x86") else machine
+    return (os_name, arch)
+
+def _version_key(version):
+    return [int(x) if x.isdigit() else x for x in str(version).replace("-",".").split(".")]
+
+class BinaryCache:
+
+    def __init__(self, root, lock_dir = None):
+        # Index updates hold an advisory lock in lock_dir (root by default) -
+        # see lock.lock_for()
+        self.root = root
+        self.lock_dir = lock_dir or root
+        self.index_path = os.path.join(root, INDEX)
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def entries(self, os_name = None, arch = None, version = None):
+        # Returns the index entries matching whatever was passed, newest first
+        return sorted(
+            (e for e in self._load().values() if all(x is None or e[k] == x for k, x in (("os",os_name),("arch",arch),("version",version)))),
+            key=lambda e: (_version_key(e["version"]), e["os"], e["arch"]),
+            reverse=True
+        )
+
+    def get(self, os_name, arch, version = None):
+        # Returns the full path to the newest (or the passed version's) binary
+        # for os_name/arch - Mac binaries built for several archs count for all
+        # of them
+        for e in self.entries(os_name, None, version):
+            if e["arch"] in (arch, "universal") and os.path.isfile(os.path.join(self.root, e["path"])):
+                return os.path.join(self.root, e["path"])
+        return None
+
+    def has_version(self, version):
+        return any(os.path.isfile(os.path.join(self.root, e["path"])) for e in self.entries(version=version))
+
+    def _extract(self, zip_path, member, version):
+        # Runs on a worker thread - each gets its own handle on the zip
+        import zipfile
+        with zipfile.ZipFile(zip_path) as z:
+            data = z.read(member)
+        name = os.path.basename(member)
+        target = identify(data) or ("unknown", name)
+        rel = os.path.join(str(version), "{}-{}".format(*target), name)
+        path = os.path.join(self.root, rel)
+        if not os.path.isdir(os.path.dirname(path)):
+            try: os.makedirs(os.path.dirname(path))
+            except OSError: pass # Another worker beat us to it
+        writer.atomic_write(path, data)
+        if os.name != "nt" and target[0] != "windows":
+            os.chmod(path, 0o755)
+        return {
+            "os":target[0],
+            "arch":target[1],
+            "version":str(version),
+            "name":name,
+            "path":rel.replace(os.sep,"/"),
+            "size":len(data),
+            "sha256":hashlib.sha256(data).hexdigest()
+        }
+
+    def add_from_zip(self, zip_path, members, version, workers = 4):
+        # Extracts members (names within the zip) concurrently, files each one
+        # under the platform its headers say it's for, and returns the new
+        # index entries
+        from multiprocessing.pool import ThreadPool
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        pool = ThreadPool(max(1,min(workers,len(members))))
+        try:
+            added = pool.map(lambda m: self._extract(zip_path, m, version), members)
+        finally:
+            pool.close()
+            pool.join()
+        # Other instances may be adding to the index too - merge under the lock
+        # so nobody's entries get dropped
+        with lock.lock_for(self.index_path, self.lock_dir):
+            index = self._load()
+            for e in added:
+                index["/".join((e["os"],e["arch"],e["version"]))] = e
+            writer.atomic_write(self.index_path, json.dumps(index, indent=2, sort_keys=True).encode("utf-8"))
+        return added
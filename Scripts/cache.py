@@ -0,0 +1,140 @@
+import os, json, hashlib, time
+from Scripts import lock, writer
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class PlistCache:
+
+    def __init__(self, cache_dir, max_entries = 8, lock_dir = None):
+        # Keeps pickled snapshots of parsed plists on disk keyed by the absolute
+        # path, mtime, size, and content hash of the source file.  Only the
+        # max_entries most recently used snapshots are kept.  Index updates
+        # hold an advisory lock in lock_dir (cache_dir by default) so parallel
+        # instances don't drop each other's entries.
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.lock_dir = lock_dir or cache_dir
+        self.index_file = os.path.join(self.cache_dir,"index.json")
+        # Hits are only noted in memory - they're folded into the index the
+        # next time it has to be written anyway
+        self.used = {}
+
+    def _load_index(self):
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except:
+            index = {}
+        return index if isinstance(index,dict) else {}
+
+    def _save_index(self, index):
+        try:
+            for path, used in self.used.items():
+                if path in index:
+                    index[path]["used"] = max(used,index[path].get("used",0))
+            self.used = {}
+            writer.atomic_write(self.index_file,json.dumps(index,indent=2).encode("utf-8"),fsync="none")
+        except:
+            pass
+
+    def _update_index(self, update):
+        # Runs update(index) under the index lock, and writes the index back if
+        # it returns True
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with lock.lock_for(self.index_file, self.lock_dir):
+            index = self._load_index()
+            if update(index):
+                self._save_index(index)
+
+    def _remove(self, entry):
+        try: os.remove(os.path.join(self.cache_dir,entry["file"]))
+        except: pass
+
+    def key(self, path, data = None):
+        # Returns a (mtime, size, sha256) tuple for the file at path - data can
+        # be its contents if the caller has already read them
+        st = os.stat(path)
+        if data is not None:
+            return (st.st_mtime, st.st_size, hashlib.sha256(data).hexdigest())
+        h = hashlib.sha256()
+        with open(path,"rb") as f:
+            while True:
+                chunk = f.read(1048576)
+                if not chunk: break
+                h.update(chunk)
+        return (st.st_mtime, st.st_size, h.hexdigest())
+
+    def get(self, path, key = None):
+        # Returns the cached value for path if the file hasn't changed, or None.
+        # The file is only hashed once its mtime and size match the snapshot's.
+        path = os.path.abspath(path)
+        index = self._load_index()
+        entry = index.get(path)
+        if not entry:
+            return None
+        try:
+            st = os.stat(path)
+            if entry["mtime"] != st.st_mtime or entry["size"] != st.st_size:
+                return None
+            if key is None:
+                key = self.key(path)
+            if list(key) != [entry["mtime"],entry["size"],entry["hash"]]:
+                return None
+            with open(os.path.join(self.cache_dir,entry["file"]),"rb") as f:
+                value = pickle.load(f)
+        except:
+            # Stale or corrupt - drop it
+            self._remove(entry)
+            try: self._update_index(lambda index: index.pop(path,None) is not None)
+            except: pass
+            return None
+        self.used[path] = time.time()
+        return value
+
+    def put(self, path, value, key = None):
+        # Snapshots value for path, evicting the least recently used entries
+        # past max_entries.  Returns whether the value could be cached.
+        path = os.path.abspath(path)
+        if self.max_entries < 1:
+            return False
+        try:
+            if key is None:
+                key = self.key(path)
+            data = pickle.dumps(value,pickle.HIGHEST_PROTOCOL)
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            file_name = hashlib.sha256(path.encode("utf-8")).hexdigest()+".pickle"
+            writer.atomic_write(os.path.join(self.cache_dir,file_name),data,fsync="none")
+        except:
+            # Unpicklable values (i.e. views over a memory-mapped file) or
+            # write issues - just don't cache
+            return False
+        def update(index):
+            index[path] = {
+                "mtime":key[0],
+                "size":key[1],
+                "hash":key[2],
+                "file":file_name,
+                "used":time.time()
+            }
+            # Evict anything past our max - counting hits we haven't saved yet
+            used = lambda x: max(index[x].get("used",0),self.used.get(x,0))
+            for old in sorted(index,key=used)[:-self.max_entries]:
+                self._remove(index.pop(old))
+            return True
+        try:
+            self._update_index(update)
+        except:
+            return False
+        return True
+
+    def clear(self):
+        def update(index):
+            for path in index:
+                self._remove(index[path])
+            index.clear()
+            return True
+        self._update_index(update)
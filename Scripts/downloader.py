@@ -1,13 +1,10 @@
-import sys, os, time, ssl, gzip, multiprocessing
+import sys, os, time
 from io import BytesIO
-# Python-aware urllib stuff
+# ssl, gzip, multiprocessing and urllib are imported on first use - they're a
+# large chunk of our startup time, and most runs never touch the network
 try:
-    from urllib.request import urlopen, Request
     import queue as q
 except ImportError:
-    # Import urllib2 to catch errors
-    import urllib2
-    from urllib2 import urlopen, Request
     import Queue as q
 
 TERMINAL_WIDTH = 120 if os.name=="nt" else 80
@@ -46,6 +43,16 @@ def get_size(size, suffix=None, use_1024=False, round_to=2, strip_zeroes=False):
     b = b.rstrip("0") if strip_zeroes else b.ljust(round_to,"0") if round_to > 0 else ""
     return "{:,}{} {}".format(int(a),"" if not b else "."+b,biggest)
 
+def _hand_over_stdout():
+    # The progress display writes straight to the terminal from another
+    # process - anything we've printed has to be out first, and a screen being
+    # diffed (see utils._Frame) can't know what the display did to it
+    redraw = getattr(sys.stdout, "redraw", None)
+    if redraw:
+        redraw()
+    else:
+        sys.stdout.flush()
+
 def _process_hook(queue, total_size, bytes_so_far=0, update_interval=1.0, max_packets=0):
     packets = []
     speed = remaining = ""
@@ -145,20 +152,36 @@ class Downloader:
     def __init__(self,**kwargs):
         self.ua = kwargs.get("useragent",{"User-Agent":"Mozilla"})
         self.chunk = 1048576 # 1024 x 1024 i.e. 1MiB
+        # Retry policy for download() - waits backoff, then twice that, and so
+        # on up to max_backoff seconds between attempts
+        self.retries = kwargs.get("retries",4)
+        self.backoff = kwargs.get("backoff",1.0)
+        self.max_backoff = kwargs.get("max_backoff",30.0)
         if os.name=="nt": os.system("color") # Initialize cmd for ANSI escapes
-        # Provide reasonable default logic to workaround macOS CA file handling 
-        cafile = ssl.get_default_verify_paths().openssl_cafile
-        try:
-            # If default OpenSSL CA file does not exist, use that from certifi
-            if not os.path.exists(cafile):
-                import certifi
-                cafile = certifi.where()
-            self.ssl_context = ssl.create_default_context(cafile=cafile)
-        except:
-            # None of the above worked, disable certificate verification for now
-            self.ssl_context = ssl._create_unverified_context()
+        self._ssl_context = None # Built by the ssl_context property when first needed
         return
 
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            import ssl
+            # Provide reasonable default logic to workaround macOS CA file handling 
+            cafile = ssl.get_default_verify_paths().openssl_cafile
+            try:
+                # If default OpenSSL CA file does not exist, use that from certifi
+                if not os.path.exists(cafile):
+                    import certifi
+                    cafile = certifi.where()
+                self._ssl_context = ssl.create_default_context(cafile=cafile)
+            except:
+                # None of the above worked, disable certificate verification for now
+                self._ssl_context = ssl._create_unverified_context()
+        return self._ssl_context
+
+    @ssl_context.setter
+    def ssl_context(self, value):
+        self._ssl_context = value
+
     def _decode(self, value, encoding="utf-8", errors="ignore"):
         # Helper method to only decode if bytes type
         if sys.version_info >= (3,0) and isinstance(value, bytes):
@@ -204,16 +227,61 @@ class Downloader:
             new_headers[k] = target[k]
         return new_headers
 
-    def open_url(self, url, headers = None):
+    def _open_url(self, url, headers = None):
+        # open_url() that raises on failure
+        try:
+            from urllib.request import urlopen, Request
+        except ImportError:
+            from urllib2 import urlopen, Request
         headers = self._get_headers(headers)
+        return urlopen(Request(url, headers=headers), context=self.ssl_context)
+
+    def open_url(self, url, headers = None):
         # Wrap up the try/except block so we don't have to do this for each function
         try:
-            response = urlopen(Request(url, headers=headers), context=self.ssl_context)
+            response = self._open_url(url, headers)
         except Exception as e:
             # No fixing this - bail
             return None
         return response
 
+    def _fetch(self, url, headers = None, as_string = True, expand_gzip = True):
+        # get_bytes()/get_string() without the progress display - raises on
+        # failure so get_many() can say why
+        response = self._open_url(url, headers)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        if expand_gzip and response.headers.get("Content-Encoding","unknown").lower() == "gzip":
+            import gzip
+            data = gzip.GzipFile(fileobj=BytesIO(data)).read()
+        return self._decode(data) if as_string else data
+
+    def get_many(self, urls, workers = 4, headers = None, as_string = True, expand_gzip = True):
+        # Fetches urls concurrently with up to workers threads, and returns a
+        # list of (value, error) tuples in the same order - value is None and
+        # error is the exception if that URL failed
+        import threading
+        urls = list(urls)
+        results = [None]*len(urls)
+        todo = q.Queue()
+        for i, url in enumerate(urls):
+            todo.put((i, url))
+        def worker():
+            while True:
+                try: i, url = todo.get_nowait()
+                except q.Empty: return
+                try: results[i] = (self._fetch(url, headers, as_string, expand_gzip), None)
+                except Exception as e: results[i] = (None, e)
+        threads = [threading.Thread(target=worker) for _ in range(max(1,min(workers,len(urls))))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
     def get_size(self, *args, **kwargs):
         return get_size(*args,**kwargs)
 
@@ -231,6 +299,7 @@ class Downloader:
         packets = queue = process = None
         if progress:
             # Make sure our vars are initialized
+            import multiprocessing
             packets = [] if progress else None
             queue = multiprocessing.Queue()
             # Create the multiprocess and start it
@@ -242,6 +311,7 @@ class Downloader:
             # Filthy hack for earlier python versions on Windows
             if os.name == "nt" and hasattr(multiprocessing,"forking"):
                 self._update_main_name()
+            _hand_over_stdout()
             process.start()
         try:
             while True:
@@ -256,6 +326,7 @@ class Downloader:
             response.close()
         if expand_gzip and response.headers.get("Content-Encoding","unknown").lower() == "gzip":
             fileobj = BytesIO(chunk_so_far)
+            import gzip
             gfile   = gzip.GzipFile(fileobj=fileobj)
             return gfile.read()
         if progress:
@@ -292,8 +363,13 @@ class Downloader:
                 new_headers["Range"] = byte_string
                 response = self.open_url(url, new_headers)
                 if response is None: return None
+                if response.getcode() != 206:
+                    # Server ignored our range and is sending it all again
+                    bytes_so_far = 0
+                    mode = "wb"
         if progress:
             # Make sure our vars are initialized
+            import multiprocessing
             packets = [] if progress else None
             queue = multiprocessing.Queue()
             # Create the multiprocess and start it
@@ -305,9 +381,10 @@ class Downloader:
             # Filthy hack for earlier python versions on Windows
             if os.name == "nt" and hasattr(multiprocessing,"forking"):
                 self._update_main_name()
+            _hand_over_stdout()
             process.start()
-        with open(file_path,mode) as f:
-            try:
+        try:
+            with open(file_path,mode) as f:
                 while True:
                     chunk = response.read(self.chunk)
                     bytes_so_far += len(chunk)
@@ -316,15 +393,40 @@ class Downloader:
                         queue.put((time.time(),len(chunk)))
                     if not chunk: break
                     f.write(chunk)
-            finally:
-                # Close the response whenever we're done
-                response.close()
-        if progress:
-            # Finalize the queue and wait
-            queue.put("DONE")
-            process.join()
+        finally:
+            # Close the response whenever we're done
+            response.close()
+            if progress:
+                # Finalize the queue and wait - even if the connection dropped
+                queue.put("DONE")
+                process.join()
         if ensure_size_if_present and total_size != -1:
             # We're verifying size - make sure we got what we asked for
             if bytes_so_far != total_size:
                 return None # We didn't - imply it failed
         return file_path if os.path.exists(file_path) else None
+
+    def download(self, url, file_path, progress = True, headers = None, retries = None, backoff = None, resume_existing = False):
+        # stream_to_file() that survives dropped connections - each retry picks
+        # up from the bytes already on disk via a Range request.  retries and
+        # backoff default to the policy set on this Downloader.  Any file
+        # already at file_path is replaced unless resume_existing is True.
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        if not resume_existing and os.path.isfile(file_path):
+            os.remove(file_path)
+        attempt = 0
+        while True:
+            try:
+                result = self.stream_to_file(url, file_path, progress, headers, allow_resume=True)
+                if result: return result
+                error = "incomplete download"
+            except Exception as e:
+                error = e
+            if attempt >= retries:
+                return None
+            delay = min(self.max_backoff, backoff*(2**attempt))
+            attempt += 1
+            if progress:
+                print("\n - Download failed ({}) - retrying in {:g}s ({}/{})...".format(error,delay,attempt,retries))
+            time.sleep(delay)
@@ -0,0 +1,110 @@
+import binascii
+from array import array
+from collections import namedtuple
+
+FIELDS = ("model","serial","board_serial","uuid","rom")
+
+# A single generated identity - a plain tuple underneath, so it indexes, packs
+# and compares like the lists it replaces without any per-instance dict
+Identity = namedtuple("Identity", FIELDS)
+
+# Packed widths - serials and MLBs are ASCII, padded with NULs when shorter
+SERIAL_SIZE = 12
+BOARD_SERIAL_SIZE = 17
+UUID_SIZE = 16
+ROM_SIZE = 6
+
+def format_uuid(raw):
+    # 16 raw bytes -> uppercase 8-4-4-4-12 string
+    h = binascii.hexlify(raw).decode("ascii").upper()
+    return "{}-{}-{}-{}-{}".format(h[:8],h[8:12],h[12:16],h[16:20],h[20:])
+
+def _pack_text(value, size, name):
+    value = value.encode("ascii") if not isinstance(value, bytes) else value
+    if len(value) > size:
+        raise ValueError("{} is too long to pack: {}".format(name, value))
+    return value.ljust(size, b"\x00")
+
+class IdentityBatch:
+
+    def __init__(self):
+        # Column-wise storage - models are interned and referenced by index,
+        # everything else lives in one packed buffer per field.  Values are
+        # only turned back into strings when an Identity is read out.
+        self.models = []
+        self._model_index = {}
+        self._model_refs = array("H")
+        self.serials = bytearray()
+        self.board_serials = bytearray()
+        self.uuids = bytearray()
+        self.roms = bytearray()
+
+    def __len__(self):
+        return len(self._model_refs)
+
+    def __bool__(self):
+        return len(self) > 0
+    __nonzero__ = __bool__ # Python 2
+
+    def _model_ref(self, model):
+        ref = self._model_index.get(model)
+        if ref is None:
+            ref = self._model_index[model] = len(self.models)
+            self.models.append(model)
+        return ref
+
+    def append(self, model, serial, board_serial, uuid, rom):
+        # uuid and rom can be strings (as formatted for output) or raw bytes
+        serial = _pack_text(serial, SERIAL_SIZE, "serial")
+        board_serial = _pack_text(board_serial, BOARD_SERIAL_SIZE, "board serial")
+        if not isinstance(uuid, (bytes, bytearray)):
+            uuid = binascii.unhexlify(uuid.replace("-","").encode("ascii"))
+        if not isinstance(rom, (bytes, bytearray)):
+            rom = binascii.unhexlify(rom.encode("ascii"))
+        if len(uuid) != UUID_SIZE or len(rom) != ROM_SIZE:
+            raise ValueError("UUIDs must be {} bytes and ROMs {} bytes".format(UUID_SIZE, ROM_SIZE))
+        self._model_refs.append(self._model_ref(model))
+        self.serials += serial
+        self.board_serials += board_serial
+        self.uuids += uuid
+        self.roms += rom
+
+    def extend(self, records):
+        for r in records:
+            self.append(*r)
+
+    def extend_generated(self, lines, uuids, roms):
+        # Fast path for fresh macserial output - lines are (model, serial,
+        # board serial) tuples, uuids is len(lines)*16 raw bytes and roms is
+        # len(lines)*6 raw bytes
+        count = len(lines)
+        if len(uuids) != count*UUID_SIZE or len(roms) != count*ROM_SIZE:
+            raise ValueError("Need {} UUID bytes and {} ROM bytes".format(count*UUID_SIZE, count*ROM_SIZE))
+        self._model_refs.extend(self._model_ref(l[0]) for l in lines)
+        self.serials += b"".join(_pack_text(l[1], SERIAL_SIZE, "serial") for l in lines)
+        self.board_serials += b"".join(_pack_text(l[2], BOARD_SERIAL_SIZE, "board serial") for l in lines)
+        self.uuids += uuids
+        self.roms += roms
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("IdentityBatch index out of range")
+        return Identity(
+            self.models[self._model_refs[index]],
+            bytes(self.serials[index*SERIAL_SIZE:(index+1)*SERIAL_SIZE]).rstrip(b"\x00").decode("ascii"),
+            bytes(self.board_serials[index*BOARD_SERIAL_SIZE:(index+1)*BOARD_SERIAL_SIZE]).rstrip(b"\x00").decode("ascii"),
+            format_uuid(bytes(self.uuids[index*UUID_SIZE:(index+1)*UUID_SIZE])),
+            binascii.hexlify(bytes(self.roms[index*ROM_SIZE:(index+1)*ROM_SIZE])).decode("ascii").upper()
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        # Rough size of the packed data - not counting the interned models
+        return len(self._model_refs)*self._model_refs.itemsize+len(self.serials)+len(self.board_serials)+len(self.uuids)+len(self.roms)
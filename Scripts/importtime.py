@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Cold start check for GenSMBIOS.py - imports it in fresh interpreters with
+# -X importtime, and fails if the median import takes longer than the budget,
+# or if any module we defer until first use sneaks back into startup.
+#
+# Run from the repo root:
+#
+#   python -m Scripts.importtime
+#   python -m Scripts.importtime --budget 40 --repeat 9 --verbose
+#
+# Timings include everything GenSMBIOS pulls in, but not interpreter startup
+# itself.  Bytecode is compiled up front so the numbers don't depend on
+# whether __pycache__ happened to be warm.
+import os, sys, subprocess, argparse, compileall
+
+# Cumulative import time for GenSMBIOS, in milliseconds
+BUDGET_MS = 50
+# Only needed for downloads, extracting macserial, the CLI, caching, or
+# serving - none of which should be paid for just to show the menu
+DEFERRED = (
+    "argparse",
+    "gzip",
+    "http.server",
+    "multiprocessing",
+    "pickle",
+    "shutil",
+    "ssl",
+    "tempfile",
+    "urllib.request",
+    "zipfile",
+    "Scripts.bincache",
+    "Scripts.cache",
+    "Scripts.identity",
+    "Scripts.output",
+    "Scripts.pool",
+    "Scripts.serials",
+    "Scripts.service"
+)
+
+def measure(root, module="GenSMBIOS"):
+    # Returns ({module:cumulative_us}, total_us) for one cold import of module
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE",None)
+    p = subprocess.Popen(
+        [sys.executable,"-X","importtime","-c","import {}".format(module)],
+        cwd=root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, err = p.communicate()
+    if p.returncode != 0:
+        raise Exception("Failed to import {}:\n{}".format(module,err.decode("utf-8","ignore")))
+    modules = {}
+    for line in err.decode("utf-8","ignore").split("\n"):
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) != 3 or not line.startswith("import time:"):
+            continue
+        try: modules[parts[2].strip()] = int(parts[1])
+        except ValueError: continue
+    return (modules, modules.get(module,0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check GenSMBIOS.py's import time against a budget")
+    parser.add_argument("--budget", type=float, default=BUDGET_MS, help="allowed median import time in ms (default: {})".format(BUDGET_MS))
+    parser.add_argument("--repeat", type=int, default=5, help="cold imports to take the median of")
+    parser.add_argument("--verbose", action="store_true", help="list the slowest imports")
+    args = parser.parse_args(argv)
+    if sys.version_info < (3,7):
+        print("-X importtime needs Python 3.7 or newer.")
+        return 0
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    compileall.compile_file(os.path.join(root,"GenSMBIOS.py"), quiet=1)
+    compileall.compile_dir(os.path.join(root,"Scripts"), quiet=1)
+    runs = sorted((measure(root) for _ in range(max(1,args.repeat))), key=lambda x: x[1])
+    modules, total = runs[len(runs)//2]
+    median = total/1000.0
+    failed = False
+    print("GenSMBIOS import: {:.1f} ms median of {} (budget {:.1f} ms)".format(median,len(runs),args.budget))
+    if median > args.budget:
+        print(" - Over budget!")
+        failed = True
+    loaded = sorted(x for x in DEFERRED if x in modules)
+    if loaded:
+        print(" - Imported at startup but should be deferred: {}".format(", ".join(loaded)))
+        failed = True
+    if args.verbose:
+        for name, us in sorted(modules.items(), key=lambda x: x[1], reverse=True)[:15]:
+            print("   {:>8.1f} ms  {}".format(us/1000.0,name))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import os, time, hashlib, threading
+
+if os.name == "nt":
+    # Windows
+    import msvcrt
+else:
+    # Not Windows \o/
+    import fcntl
+
+class FileLock:
+
+    def __init__(self, path, timeout = None, poll = 0.05):
+        # Advisory lock held on path (created if needed) - shared between any
+        # processes that use the same lock path.  timeout is in seconds, and
+        # None waits forever.  Instances can be shared between threads - the
+        # thread lock is held for as long as the file lock, so other threads
+        # wait their turn and only the owner can nest.
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._fd = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def _try_lock(self):
+        try:
+            if os.name == "nt":
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def _timed_out(self, start):
+        if self.timeout is not None and time.time() - start >= self.timeout:
+            raise IOError("Timed out waiting for lock: {}".format(self.path))
+
+    def acquire(self):
+        start = time.time()
+        # Other threads first - RLock.acquire() has no timeout on Python 2
+        if self.timeout is None:
+            self._thread_lock.acquire()
+        else:
+            while not self._thread_lock.acquire(False):
+                self._timed_out(start)
+                time.sleep(self.poll)
+        if self._depth:
+            # Already ours - just nest
+            self._depth += 1
+            return
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            if os.name != "nt" and self.timeout is None:
+                # Let the kernel wait for us
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            else:
+                while not self._try_lock():
+                    self._timed_out(start)
+                    time.sleep(self.poll)
+        except:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+        self._depth = 1
+
+    def release(self):
+        if not self._depth:
+            return
+        try:
+            self._depth -= 1
+            if self._depth:
+                return
+            try:
+                if os.name == "nt":
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def lock_for(path, lock_dir, **kwargs):
+    # Returns a FileLock guarding path whose lock file lives in lock_dir (named
+    # by a hash of the full path) - so nothing is left next to the target,
+    # which may be a config on an EFI partition
+    if not os.path.isdir(lock_dir):
+        try: os.makedirs(lock_dir)
+        except OSError: pass # Another instance beat us to it
+    name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return FileLock(os.path.join(lock_dir, name+".lock"), **kwargs)
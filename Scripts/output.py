@@ -0,0 +1,58 @@
+import sys, csv, json
+from collections import OrderedDict
+
+FORMATS = ("text","csv","json")
+
+def open_output(path = None):
+    # Returns a text file object for path - or stdout if path is None or "-"
+    if path in (None,"-"):
+        return sys.stdout
+    if sys.version_info >= (3,0):
+        return open(path,"w",newline="")
+    return open(path,"wb")
+
+class RecordWriter:
+
+    def __init__(self, fp, fields, fmt = "text"):
+        # Streams records (tuples matching fields) to fp as they're written -
+        # text is " | " separated like macserial's output, csv gets a header row,
+        # and json is a single array of objects
+        if not fmt in FORMATS:
+            raise ValueError("Unknown output format: {}".format(fmt))
+        self.fp = fp
+        self.fields = list(fields)
+        self.fmt = fmt
+        self.count = 0
+        if fmt == "csv":
+            self._csv = csv.writer(fp)
+            self._csv.writerow(self.fields)
+        elif fmt == "json":
+            self.fp.write("[")
+
+    def write_many(self, records):
+        if self.fmt == "csv":
+            rows = [list(r) for r in records]
+            self._csv.writerows(rows)
+            self.count += len(rows)
+        elif self.fmt == "json":
+            out = []
+            for r in records:
+                out.append(("\n  " if not self.count and not out else ",\n  ")+json.dumps(OrderedDict(zip(self.fields,r))))
+            self.fp.write("".join(out))
+            self.count += len(out)
+        else:
+            lines = [" | ".join("" if x is None else str(x) for x in r) for r in records]
+            if lines:
+                self.fp.write("\n".join(lines)+"\n")
+            self.count += len(lines)
+
+    def write(self, record):
+        self.write_many([record])
+
+    def close(self):
+        # Finishes off the output - doesn't close stdout
+        if self.fmt == "json":
+            self.fp.write("\n]\n" if self.count else "]\n")
+        self.fp.flush()
+        if self.fp is not sys.stdout:
+            self.fp.close()
@@ -2,7 +2,7 @@
 # Imports #
 ###     ###
 
-import datetime, os, plistlib, struct, sys, itertools, binascii
+import datetime, os, plistlib, re, struct, sys, binascii, hashlib
 from io import BytesIO
 
 if sys.version_info < (3,0):
@@ -35,9 +35,13 @@ def wrap_data(value):
     return value
 
 def extract_data(value):
-    if not _check_py3() and isinstance(value,plistlib.Data): return value.data
+    if isinstance(value,LazyData) or (not _check_py3() and isinstance(value,plistlib.Data)): return value.data
     return value
 
+def _is_data(value):
+    # Returns whether the passed value is one of our data wrapper types
+    return isinstance(value, LazyData) or (hasattr(plistlib, "Data") and isinstance(value, plistlib.Data))
+
 def _check_py3():
     return sys.version_info >= (3, 0)
 
@@ -84,15 +88,17 @@ def writePlist(value, pathOrFile):
 # Remapped Functions #
 ###                ###
 
-def load(fp, fmt=None, use_builtin_types=None, dict_type=dict):
+def load(fp, fmt=None, use_builtin_types=None, dict_type=dict, keys=None, lazy_data=False):
     if _is_binary(fp):
         use_builtin_types = False if use_builtin_types is None else use_builtin_types
-        try:
-            p = _BinaryPlistParser(use_builtin_types=use_builtin_types, dict_type=dict_type)
-        except:
-            # Python 3.9 removed use_builtin_types
-            p = _BinaryPlistParser(dict_type=dict_type)
+        # Parse straight from a memory map of the file where we can - any
+        # containers off the requested key paths are left as lazy views
+        p = _MappedBinaryPlistParser(use_builtin_types=use_builtin_types, dict_type=dict_type, lazy=keys is not None, keys=keys)
         return p.parse(fp)
+    elif keys is not None:
+        # Only parse the byte ranges of the requested subtrees
+        parse = lambda raw, sub_keys: load(BytesIO(raw), fmt=fmt, use_builtin_types=use_builtin_types, dict_type=dict_type, keys=sub_keys, lazy_data=lazy_data)
+        return _load_selective(fp, keys, parse, dict_type)
     elif _check_py3():
         offset = _seek_past_whitespace(fp)
         use_builtin_types = True if use_builtin_types is None else use_builtin_types
@@ -124,6 +130,9 @@ def load(fp, fmt=None, use_builtin_types=None, dict_type=dict):
                 else:
                     raise OverflowError("Integer overflow at line {}".format(p.parser.CurrentLineNumber))
             def end_data():
+                if lazy_data:
+                    # Hold onto the base64 text - only decode when asked
+                    return p.add_object(LazyData(p.get_data()))
                 try:
                     p.add_object(plistlib._decode_base64(p.get_data()))
                 except Exception as e:
@@ -182,27 +191,55 @@ def load(fp, fmt=None, use_builtin_types=None, dict_type=dict):
         parser.ParseFile(fp)
         return p.root
 
-def loads(value, fmt=None, use_builtin_types=None, dict_type=dict):
+def load_mapped(fp, use_builtin_types=None, dict_type=dict):
+    # Memory-maps a binary plist and returns its root with every container left
+    # as a MappedDict or MappedArray view - objects are only parsed when accessed.
+    # The file stays mapped until the root is closed, so use it as a context
+    # manager or call close() on it when done.  XML plists can't be randomly
+    # accessed, so those are just loaded normally.
+    if not _is_binary(fp):
+        return load(fp, use_builtin_types=use_builtin_types, dict_type=dict_type)
+    use_builtin_types = False if use_builtin_types is None else use_builtin_types
+    p = _MappedBinaryPlistParser(use_builtin_types=use_builtin_types, dict_type=dict_type, lazy=True)
+    return p.parse(fp)
+
+def loads(value, fmt=None, use_builtin_types=None, dict_type=dict, keys=None, lazy_data=False):
     if _check_py3() and isinstance(value, basestring):
         # If it's a string - encode it
         value = value.encode()
     try:
-        return load(BytesIO(value),fmt=fmt,use_builtin_types=use_builtin_types,dict_type=dict_type)
+        return load(BytesIO(value),fmt=fmt,use_builtin_types=use_builtin_types,dict_type=dict_type,keys=keys,lazy_data=lazy_data)
     except:
         # Python 3.9 removed use_builtin_types
-        return load(BytesIO(value),fmt=fmt,dict_type=dict_type)
+        return load(BytesIO(value),fmt=fmt,dict_type=dict_type,keys=keys,lazy_data=lazy_data)
 
 def dump(value, fp, fmt=FMT_XML, sort_keys=True, skipkeys=False):
     if fmt == FMT_BINARY:
-        # Assume binary at this point
+        # Assume binary at this point - and make sure any skipped subtrees
+        # are loaded first, as we can't reuse their raw XML here
+        value = _materialize(value)
         writer = _BinaryPlistWriter(fp, sort_keys=sort_keys, skipkeys=skipkeys)
         writer.write(value)
     elif fmt == FMT_XML:
         if _check_py3():
-            plistlib.dump(value, fp, fmt=fmt, sort_keys=sort_keys, skipkeys=skipkeys)
+            writer = plistlib._PlistWriter(fp, sort_keys=sort_keys, skipkeys=skipkeys)
+            # Monkey patch to write any skipped subtrees back out verbatim
+            write_value = writer.write_value
+            def _write_value(value):
+                if isinstance(value, RawValue):
+                    writer.writeln(value.raw)
+                elif isinstance(value, LazyData):
+                    writer.writeln(value.xml())
+                elif isinstance(value, _MappedValue):
+                    write_value(_materialize(value))
+                else:
+                    write_value(value)
+            writer.write_value = _write_value
+            writer.write(value)
         else:
             # We need to monkey patch a bunch here too in order to avoid auto-sorting
             # of keys
+            value = _materialize(value)
             writer = plistlib.PlistWriter(fp)
             def writeDict(d):
                 if d:
@@ -232,10 +269,509 @@ def dumps(value, fmt=FMT_XML, skipkeys=False, sort_keys=True):
     f = BytesIO() if _check_py3() else StringIO()
     dump(value, f, fmt=fmt, skipkeys=skipkeys, sort_keys=sort_keys)
     value = f.getvalue()
-    if _check_py3():
+    if _check_py3() and fmt == FMT_XML:
+        # Binary plists aren't valid utf-8 - leave those as bytes
         value = value.decode("utf-8")
     return value
 
+###           ###
+# Lazy Data #
+###           ###
+
+# Passing lazy_data=True to load() keeps <data> elements as LazyData objects that
+# hold onto their base64 text.  Nothing is decoded until .data is accessed, and
+# dump() writes the original text back out without a decode/encode round trip.
+# LazyData is immutable - to change a value, replace it.
+
+class LazyData(object):
+    def __init__(self, b64):
+        self._b64 = b64
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = plistlib._decode_base64(self._b64) if _check_py3() else binascii.a2b_base64(self._b64)
+        return self._data
+
+    def xml(self):
+        # Returns the <data> element with the original base64 text
+        b64 = self._b64.strip()
+        if isinstance(b64, unicode):
+            b64 = b64.encode("utf-8")
+        return b"<data>"+b64+b"</data>"
+
+    def __bytes__(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyData):
+            return self._b64 == other._b64 or self.data == other.data
+        if hasattr(plistlib, "Data") and isinstance(other, plistlib.Data):
+            other = other.data
+        return self.data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def __repr__(self):
+        return "%s(%d chars)" % (self.__class__.__name__, len(self._b64))
+
+###                 ###
+# Selective Loading #
+###                 ###
+
+# Passing keys to load() only builds the subtrees along those key paths.  The
+# top-level dict is scanned for each key's byte range without parsing, only the
+# requested ranges go through expat, and the rest are kept as RawValue objects.
+# Those are written back out as-is by dump(), and only parsed if something
+# actually asks for their value.  When the plist came from a real file, a
+# RawValue only remembers where its bytes are (and their hash), so skipped
+# subtrees cost no memory.
+
+class RawValue(object):
+    def __init__(self, raw, dict_type=dict, source=None, digest=None):
+        # raw is the element's XML - or None, with source set to a (path,
+        # start, end) tuple to read it back from and digest to the SHA-1 of
+        # those bytes, so a changed file is caught instead of misread
+        self._raw = raw
+        self._source = source
+        self._digest = digest
+        self._dict_type = dict_type
+        self._value = _undefined
+
+    @property
+    def raw(self):
+        if self._raw is not None:
+            return self._raw
+        path, start, end = self._source
+        with open(path, "rb") as f:
+            f.seek(start)
+            raw = f.read(end-start)
+        if hashlib.sha1(raw).digest() != self._digest:
+            raise ValueError("{} changed since it was loaded".format(path))
+        return raw
+
+    @property
+    def digest(self):
+        # SHA-1 of the raw XML
+        if self._digest is None:
+            self._digest = hashlib.sha1(self._raw).digest()
+        return self._digest
+
+    @property
+    def value(self):
+        if self._value is _undefined:
+            self._value = loads(b"<plist version=\"1.0\">"+self.raw+b"</plist>", dict_type=self._dict_type)
+        return self._value
+
+    def __len__(self):
+        return len(self._raw) if self._raw is not None else self._source[2]-self._source[1]
+
+    def __repr__(self):
+        return "%s(%d bytes)" % (self.__class__.__name__, len(self))
+
+def _materialize(value):
+    # Swaps any RawValue or mapped view objects in the passed tree for their
+    # parsed values - walks with a stack to avoid the recursion limit
+    if isinstance(value, (RawValue, _MappedValue)):
+        value = value.value
+    stack = [value]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            indexes = list(current)
+        elif isinstance(current, list):
+            indexes = range(len(current))
+        else:
+            continue
+        for i in indexes:
+            v = current[i]
+            if isinstance(v, (RawValue, _MappedValue)):
+                v = current[i] = v.value
+            if isinstance(v, (dict, list)):
+                stack.append(v)
+    return value
+
+def close(value):
+    # Parses any mapped views left in value by a lazy binary load and releases
+    # the memory maps behind them, so value no longer depends on the file -
+    # needed before writing over it, as Windows won't replace a mapped file.
+    # Containers are updated in place, and the plain value is returned.
+    parsers = []
+    stack = [value]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, _MappedValue):
+            parsers.append(current._parser)
+        elif isinstance(current, dict):
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+    if not parsers:
+        return value
+    value = _materialize(value)
+    for p in parsers:
+        p.close()
+    return value
+
+_GAP = br"(?:\s|<!--.*?-->|<\?.*?\?>|<!DOCTYPE[^>]*>)*"
+_ROOT_DICT = re.compile(_GAP+br"<plist\b[^>]*>"+_GAP+br"<dict\s*(/?)>", re.S)
+_TOP_KEY = re.compile(_GAP+br"<key>([^<&]*)</key>"+_GAP, re.S)
+_TOP_END = re.compile(_GAP+br"</dict\s*>", re.S)
+_VALUE_START = re.compile(br"<([A-Za-z]+)\b[^>]*?(/?)>")
+_NESTED = dict((tag, re.compile(br"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<(/?)"+tag+br"\b[^>]*?(/?)>", re.S)) for tag in (b"dict", b"array"))
+
+def _value_end(data, start):
+    # Returns the offset just past the value element at start, or None
+    m = _VALUE_START.match(data, start)
+    if not m:
+        return None
+    tag = m.group(1)
+    if m.group(2):
+        return m.end()
+    if tag in _NESTED:
+        # Only the same tag can close it - so only count those
+        depth = 1
+        for n in _NESTED[tag].finditer(data, m.end()):
+            if n.group(1) is None:
+                continue # Comment or CDATA
+            if n.group(1):
+                depth -= 1
+                if not depth:
+                    return n.end()
+            elif not n.group(2):
+                depth += 1
+        return None
+    close = data.find(b"</"+tag+b">", m.end())
+    return None if close < 0 else close+len(tag)+3
+
+def _top_level_spans(data):
+    # Returns a list of (key, start, end) byte ranges for each value in the
+    # root dict - or None if the layout isn't one we can scan
+    m = _ROOT_DICT.match(data)
+    if not m:
+        return None
+    if m.group(1):
+        return [] # <dict/>
+    spans = []
+    pos = m.end()
+    while True:
+        k = _TOP_KEY.match(data, pos)
+        if not k:
+            return spans if _TOP_END.match(data, pos) else None
+        end = _value_end(data, k.end())
+        if end is None:
+            return None
+        spans.append((k.group(1).decode("utf-8"), k.end(), end))
+        pos = end
+
+def _load_selective(fp, keys, parse, dict_type):
+    # parse(raw, keys) loads an XML plist from bytes - used for the requested
+    # subtrees, or the whole file if its layout can't be scanned
+    keys = set((k,) if isinstance(k, basestring) else tuple(k) for k in keys)
+    if () in keys:
+        return parse(fp.read(), None)
+    buf = _map_buffer(fp)
+    mapped = not isinstance(buf, bytes)
+    path = getattr(fp, "name", None) if mapped else None
+    # Hash straight out of the map where the buffer protocol allows it
+    view = memoryview(buf) if mapped and _check_py3() else buf
+    try:
+        spans = _top_level_spans(buf)
+        if spans is None:
+            return parse(bytes(buf[:]), None)
+        root = dict_type()
+        for key, start, end in spans:
+            sub_keys = [k[1:] for k in keys if k[0] == key]
+            if not sub_keys:
+                if isinstance(path, basestring):
+                    root[key] = RawValue(None, dict_type=dict_type, source=(os.path.abspath(path), start, end), digest=hashlib.sha1(view[start:end]).digest())
+                else:
+                    root[key] = RawValue(bytes(buf[start:end]), dict_type=dict_type)
+                continue
+            root[key] = parse(b"<plist version=\"1.0\">"+buf[start:end]+b"</plist>", None if () in sub_keys else sub_keys)
+        return root
+    finally:
+        if mapped:
+            if view is not buf:
+                view.release()
+            buf.close()
+
+###                 ###
+# In-Place Patching #
+###                 ###
+
+# Lets us swap out a handful of values in an XML plist without reparsing and
+# redumping the whole thing.  We walk the file with expat and note the byte
+# offsets of the value elements we care about, then splice new values into the
+# original bytes.  Everything else is left exactly as it was on disk.
+
+class _StopIndex(Exception):
+    pass
+
+def _value_element(value):
+    # Returns a (tag, inner_text) tuple for the passed value
+    if isinstance(value, bool):
+        return ("true" if value else "false", None)
+    if _is_data(value):
+        value = value.data
+    elif isinstance(value, (int, float)) or (not _check_py3() and isinstance(value, long)):
+        return ("integer" if not isinstance(value, float) else "real", repr(value).rstrip("L").encode("utf-8"))
+    elif isinstance(value, basestring) or isinstance(value, unicode):
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        value = value.replace(b"&", b"&amp;").replace(b"<", b"&lt;").replace(b">", b"&gt;")
+        return ("string", value)
+    if isinstance(value, (bytes, bytearray)):
+        return ("data", binascii.b2a_base64(value).strip())
+    raise TypeError("Unsupported type for patching: {}".format(type(value)))
+
+def _index_values(value, paths):
+    # Walks the passed XML plist bytes and returns a dict of path -> location
+    # for each requested path.  Paths are tuples of dict keys and array indexes
+    # from the root - i.e. ("PlatformInfo","Generic","MLB").  Each location is
+    # a tuple of (tag, element_start, element_end, text_start, text_end) where
+    # the text offsets are None for empty elements.
+    from xml.parsers.expat import ParserCreate
+    targets = set(tuple(x) for x in paths)
+    found = {}
+    parser = ParserCreate()
+    # Stack of open value elements as [tag, path, start, text_start, next_key_or_index]
+    stack = []
+    state = {"key": None, "text": []}
+    def start_element(name, attrs):
+        if name == "plist":
+            return
+        if name == "key":
+            state["key"] = []
+            return
+        if not stack:
+            path = ()
+        else:
+            parent = stack[-1]
+            if parent[0] == "dict":
+                path = parent[1] + (parent[4],)
+            else:
+                path = parent[1] + (parent[4],)
+                parent[4] += 1
+        start = parser.CurrentByteIndex
+        text_start = value.find(b">", start) + 1
+        if value[text_start-2:text_start-1] == b"/":
+            text_start = None # Self-closing
+        stack.append([name, path, start, text_start, 0 if name == "array" else None])
+    def end_element(name):
+        if name == "plist":
+            return
+        if name == "key":
+            stack[-1][4] = "".join(state["key"])
+            state["key"] = None
+            return
+        tag, path, start, text_start, _ = stack.pop()
+        if not path in targets:
+            return
+        if text_start is None:
+            end = text_end = parser.CurrentByteIndex
+        else:
+            text_end = parser.CurrentByteIndex
+            end = value.find(b">", text_end) + 1
+        found[path] = (tag, start, end, text_start, None if text_start is None else text_end)
+        if len(found) == len(targets):
+            # Got everything we need - no sense in parsing the rest
+            raise _StopIndex()
+    def char_data(data):
+        if state["key"] is not None:
+            state["key"].append(data)
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = char_data
+    try:
+        parser.Parse(value, True)
+    except _StopIndex:
+        pass
+    return found
+
+def _patch_spans(value, changes):
+    # Returns a list of (start, end, replacement_bytes) sorted by start offset
+    if value.lstrip()[:8] == b"bplist00":
+        raise ValueError("Only XML plists can be patched in place")
+    found = _index_values(value, changes)
+    spans = []
+    for path, new_value in changes.items():
+        path = tuple(path)
+        if not path in found:
+            raise KeyError(path)
+        tag, start, end, text_start, text_end = found[path]
+        new_tag, inner = _value_element(new_value)
+        if tag == new_tag and text_start is not None and inner is not None:
+            # Same element type - only swap the text, and keep any whitespace
+            # padding the original had (data is usually split across lines)
+            old = value[text_start:text_end]
+            stripped = old.strip()
+            lead = old[:len(old)-len(old.lstrip())] if stripped else b""
+            trail = old[len(old.rstrip()):] if stripped else b""
+            spans.append((text_start, text_end, lead+inner+trail))
+        elif inner is None:
+            spans.append((start, end, "<{}/>".format(new_tag).encode("utf-8")))
+        else:
+            t = new_tag.encode("utf-8")
+            spans.append((start, end, b"<"+t+b">"+inner+b"</"+t+b">"))
+    spans.sort(key=lambda x: x[0])
+    return spans
+
+def patches(value, changes):
+    # Takes XML plist bytes and a dict of path -> new value, and returns the
+    # patched bytes.  Raises KeyError if any path is missing.
+    if _check_py3() and isinstance(value, str):
+        value = value.encode("utf-8")
+    spans = _patch_spans(value, changes)
+    out = []
+    last = 0
+    for start, end, data in spans:
+        out.extend((value[last:start], data))
+        last = end
+    out.append(value[last:])
+    return b"".join(out)
+
+###           ###
+# Fingerprints #
+###           ###
+
+# Merkle-style content hashes - every dict and array gets a digest built from
+# its children's digests, so two trees (or two versions of one) can be compared
+# by walking down only where the digests differ.  Dict digests ignore key
+# order, and data hashes the same whether it's bytes, Data, or LazyData.
+# RawValue placeholders hash their original XML, so only compare selectively
+# loaded trees against trees loaded with the same keys.
+
+class Fingerprint(object):
+    __slots__ = ("digest","children")
+
+    def __init__(self, digest, children=None):
+        self.digest = digest
+        # dict of key -> Fingerprint, list of Fingerprints, or None for leaves
+        self.children = children
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def hexdigest(self):
+        return binascii.hexlify(self.digest).decode("ascii")
+
+    def get(self, path):
+        # Returns the Fingerprint at the passed key path, or None if missing
+        node = self
+        for key in path:
+            try: node = node.children[key]
+            except (KeyError, IndexError, TypeError): return None
+        return node
+
+def _leaf_bytes(value):
+    # Type-tagged canonical bytes for a non-container value
+    if isinstance(value, RawValue):
+        return b"r"+value.digest
+    if isinstance(value, bool):
+        return b"b1" if value else b"b0"
+    if isinstance(value, (int, float)) or (not _check_py3() and isinstance(value, long)):
+        return (b"f" if isinstance(value, float) else b"i")+repr(value).encode("ascii")
+    if isinstance(value, unicode):
+        return b"s"+value.encode("utf-8")
+    if _is_data(value) or isinstance(value, (bytes, bytearray)):
+        # Python 2 plain strings are strings, not data
+        if not _check_py3() and isinstance(value, str):
+            return b"s"+value
+        return b"D"+bytes(extract_data(value))
+    if isinstance(value, datetime.datetime):
+        return b"t"+value.isoformat().encode("ascii")
+    if isinstance(value, UID) or (hasattr(plistlib, "UID") and isinstance(value, plistlib.UID)):
+        return b"u"+str(value.data).encode("ascii")
+    return b"?"+repr(value).encode("utf-8")
+
+def _key_bytes(key):
+    return key.encode("utf-8") if isinstance(key, unicode) else bytes(key)
+
+def fingerprint(value):
+    # Returns the Fingerprint tree for value - walks with a stack to avoid the
+    # recursion limit, hashing each container once all its children are done
+    if isinstance(value, _MappedValue):
+        value = value.value
+    root = []
+    # Entries are (value, parent's children, key, done) - done is None until
+    # a container's children have been pushed, then the dict they fill in
+    stack = [(value, root, 0, None)]
+    while stack:
+        current, parent, key, done = stack.pop()
+        if isinstance(current, _MappedValue):
+            current = current.value
+        if isinstance(current, dict):
+            if done is None:
+                children = {}
+                stack.append((current, parent, key, children))
+                for k in current:
+                    stack.append((current[k], children, k, None))
+                continue
+            children = done
+            h = hashlib.sha1(b"d")
+            for k in sorted(children, key=_key_bytes):
+                kb = _key_bytes(k)
+                h.update(struct.pack(">L", len(kb))+kb+children[k].digest)
+            node = Fingerprint(h.digest(), children)
+        elif isinstance(current, list):
+            if done is None:
+                children = {}
+                stack.append((current, parent, key, children))
+                for i, v in enumerate(current):
+                    stack.append((v, children, i, None))
+                continue
+            children = [done[i] for i in range(len(current))]
+            h = hashlib.sha1(b"a")
+            for c in children:
+                h.update(c.digest)
+            node = Fingerprint(h.digest(), children)
+        else:
+            node = Fingerprint(hashlib.sha1(_leaf_bytes(current)).digest())
+        if parent is root:
+            root.append(node)
+        else:
+            parent[key] = node
+    return root[0]
+
+def changed_paths(old, new, path=()):
+    # Takes two Fingerprint trees and returns a list of the key paths whose
+    # values differ - added, removed, or changed.  Subtrees with matching
+    # digests are skipped without looking inside.
+    out = []
+    stack = [(old, new, tuple(path))]
+    while stack:
+        a, b, p = stack.pop()
+        if a is not None and b is not None and a.digest == b.digest:
+            continue
+        if a is None or b is None or type(a.children) != type(b.children) or a.children is None:
+            out.append(p)
+        elif isinstance(a.children, dict):
+            for k in set(a.children) | set(b.children):
+                stack.append((a.children.get(k), b.children.get(k), p+(k,)))
+        else:
+            for i in range(max(len(a.children), len(b.children))):
+                stack.append((
+                    a.children[i] if i < len(a.children) else None,
+                    b.children[i] if i < len(b.children) else None,
+                    p+(i,)
+                ))
+    return sorted(out, key=lambda x: [str(k) for k in x])
+
 ###                        ###
 # Binary Plist Stuff For Py2 #
 ###                        ###
@@ -360,6 +896,8 @@ class _BinaryPlistParser:
         result = self._objects[ref]
         if result is not _undefined:
             return result
+        if self._buf is None:
+            raise ValueError("I/O operation on a closed plist")
 
         offset = self._object_offsets[ref]
         self._fp.seek(offset)
@@ -452,6 +990,297 @@ class _BinaryPlistParser:
         self._objects[ref] = result
         return result
 
+def _map_buffer(fp):
+    # Returns a read-only memory map of the file behind fp if we can make one,
+    # otherwise falls back on reading its contents
+    try:
+        import mmap
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        fp.seek(0)
+        return fp.read()
+
+def _wanted(path, keys):
+    # Returns whether the passed path is along any of the key paths
+    return any(path[:len(k)] == k or k[:len(path)] == path for k in keys)
+
+class _MappedBinaryPlistParser(_BinaryPlistParser):
+    """
+    Binary plist parser that works on a buffer (a memory map of the file where
+    possible) with struct.unpack_from and memoryview slices rather than a
+    seek/read per object.  If lazy is set, containers not along one of the keys
+    paths are returned as MappedDict/MappedArray views that only parse their
+    children when accessed.
+    """
+    def __init__(self, use_builtin_types, dict_type, lazy=False, keys=None):
+        _BinaryPlistParser.__init__(self, use_builtin_types, dict_type)
+        self._lazy = lazy
+        self._keys = set((k,) if isinstance(k, basestring) else tuple(k) for k in keys or ())
+
+    def parse(self, fp):
+        self._made_views = False
+        self._buf = _map_buffer(fp)
+        self._view = None
+        parsed = False
+        try:
+            self._view = memoryview(self._buf)
+            if len(self._buf) < 32:
+                raise InvalidFileException()
+            (
+                offset_size, self._ref_size, num_objects, top_object,
+                offset_table_offset
+            ) = struct.unpack_from('>6xBBQQQ', self._buf, len(self._buf) - 32)
+            self._object_offsets = self._read_ints(offset_table_offset, num_objects, offset_size)
+            self._objects = [_undefined] * num_objects
+            result = self._read_object(top_object)
+            parsed = True
+            return result
+
+        except (OSError, IndexError, struct.error, OverflowError,
+                UnicodeDecodeError):
+            raise InvalidFileException()
+
+        finally:
+            # Any lazy views we handed out read straight from the map - so it
+            # stays open until they're closed (see close()).  Otherwise we're
+            # done with it.
+            if not (parsed and self._made_views):
+                self.close()
+
+    def close(self):
+        # Unmaps the file - views that haven't been parsed yet can't be read
+        # afterwards.  Windows won't replace a file that's still mapped.
+        view, buf = self._view, self._buf
+        self._view = self._buf = None
+        if view is not None and hasattr(view, "release"):
+            view.release()
+        if buf is not None and not isinstance(buf, bytes):
+            buf.close()
+
+    def _get_size(self, tokenL, offset):
+        """ return the size of the next object, and the offset past it."""
+        if tokenL == 0xF:
+            s = 1 << (struct.unpack_from('>B', self._buf, offset)[0] & 0x3)
+            return self._read_ints(offset + 1, 1, s)[0], offset + 1 + s
+        return tokenL, offset
+
+    def _read_ints(self, offset, n, size):
+        if size in _BINARY_FORMAT:
+            return struct.unpack_from('>%d%s' % (n, _BINARY_FORMAT[size]), self._buf, offset)
+        if not size or offset + size * n > len(self._buf):
+            raise InvalidFileException()
+        data = self._view[offset: offset + size * n]
+        if _check_py3():
+            return tuple(int.from_bytes(data[i: i + size], 'big')
+                         for i in range(0, size * n, size))
+        return tuple(int(binascii.hexlify(data[i: i + size].tobytes()),16)
+                     for i in range(0, size * n, size))
+
+    def _read_bytes(self, offset, size):
+        if offset + size > len(self._buf):
+            raise InvalidFileException()
+        return self._view[offset: offset + size].tobytes()
+
+    def _materialize_container(self, path):
+        return not self._lazy or _wanted(path, self._keys)
+
+    def _read_object(self, ref, path=()):
+        """
+        read the object by reference.
+        May recursively read sub-objects (content of an array/dict/set)
+        """
+        result = self._objects[ref]
+        if result is not _undefined:
+            return result
+        if self._buf is None:
+            raise ValueError("I/O operation on a closed plist")
+
+        offset = self._object_offsets[ref]
+        token = struct.unpack_from('>B', self._buf, offset)[0]
+        tokenH, tokenL = token & 0xF0, token & 0x0F
+        offset += 1
+
+        if token == 0x00:
+            result = None
+
+        elif token == 0x08:
+            result = False
+
+        elif token == 0x09:
+            result = True
+
+        elif token == 0x0f:
+            result = b''
+
+        elif tokenH == 0x10:  # int
+            result = self._read_ints(offset, 1, 1 << tokenL)[0]
+            if tokenL >= 3: # Signed - adjust
+                result = result-(result & 1 << 2**tokenL*8-1)*2
+
+        elif token == 0x22: # real
+            result = struct.unpack_from('>f', self._buf, offset)[0]
+
+        elif token == 0x23: # real
+            result = struct.unpack_from('>d', self._buf, offset)[0]
+
+        elif token == 0x33:  # date
+            f = struct.unpack_from('>d', self._buf, offset)[0]
+            # timestamp 0 of binary plists corresponds to 1/1/2001
+            # (year of Mac OS X 10.0), instead of 1/1/1970.
+            result = (datetime.datetime(2001, 1, 1) +
+                      datetime.timedelta(seconds=f))
+
+        elif tokenH == 0x40:  # data
+            s, offset = self._get_size(tokenL, offset)
+            result = self._read_bytes(offset, s)
+            if not self._use_builtin_types and hasattr(plistlib, "Data"):
+                result = plistlib.Data(result)
+
+        elif tokenH == 0x50:  # ascii string
+            s, offset = self._get_size(tokenL, offset)
+            result = self._read_bytes(offset, s).decode('ascii')
+
+        elif tokenH == 0x60:  # unicode string
+            s, offset = self._get_size(tokenL, offset)
+            result = self._read_bytes(offset, s * 2).decode('utf-16be')
+
+        elif tokenH == 0x80:  # UID
+            # used by Key-Archiver plist files
+            result = UID(self._read_ints(offset, 1, 1 + tokenL)[0])
+
+        elif tokenH == 0xA0:  # array
+            s, offset = self._get_size(tokenL, offset)
+            obj_refs = self._read_ints(offset, s, self._ref_size)
+            if not self._materialize_container(path):
+                self._made_views = True
+                result = MappedArray(self, obj_refs, path)
+            else:
+                result = []
+                self._objects[ref] = result
+                result.extend(self._read_object(x, path + (i,)) for i, x in enumerate(obj_refs))
+
+        elif tokenH == 0xD0:  # dict
+            s, offset = self._get_size(tokenL, offset)
+            key_refs = self._read_ints(offset, s, self._ref_size)
+            obj_refs = self._read_ints(offset + s * self._ref_size, s, self._ref_size)
+            if not self._materialize_container(path):
+                self._made_views = True
+                result = MappedDict(self, key_refs, obj_refs, path)
+            else:
+                result = self._dict_type()
+                self._objects[ref] = result
+                for k, o in zip(key_refs, obj_refs):
+                    key = self._read_object(k)
+                    if hasattr(plistlib, "Data") and isinstance(key, plistlib.Data):
+                        key = key.data
+                    result[key] = self._read_object(o, path + (key,))
+
+        else:
+            raise InvalidFileException()
+
+        self._objects[ref] = result
+        return result
+
+class _MappedValue(object):
+    # Base for containers left unparsed by a lazy binary load.  These read from
+    # a memory map of the file until close() is called on any view from the
+    # same load (or on its result - see the module level close()), which can
+    # also be done by using the view as a context manager.
+    @property
+    def value(self):
+        # Fully parses this container and everything under it
+        if self._value is _undefined:
+            self._value = self._build()
+        return self._value
+
+    def close(self):
+        self._parser.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MappedDict(_MappedValue):
+    def __init__(self, parser, key_refs, obj_refs, path):
+        self._parser = parser
+        self._key_refs = key_refs
+        self._obj_refs = obj_refs
+        self._path = path
+        self._index = None
+        self._value = _undefined
+
+    def _get_index(self):
+        if self._index is None:
+            # Keys are cheap to parse - build a key -> ref lookup
+            self._index = self._parser._dict_type()
+            for k, o in zip(self._key_refs, self._obj_refs):
+                key = self._parser._read_object(k)
+                if hasattr(plistlib, "Data") and isinstance(key, plistlib.Data):
+                    key = key.data
+                self._index[key] = o
+        return self._index
+
+    def _build(self):
+        d = self._parser._dict_type()
+        for k in self._get_index():
+            d[k] = _materialize(self[k])
+        return d
+
+    def __getitem__(self, key):
+        return self._parser._read_object(self._get_index()[key], self._path + (key,))
+
+    def __contains__(self, key):
+        return key in self._get_index()
+
+    def __iter__(self):
+        return iter(self._get_index())
+
+    def __len__(self):
+        return len(self._key_refs)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(self._get_index())
+
+    def values(self):
+        return [self[k] for k in self._get_index()]
+
+    def items(self):
+        return [(k, self[k]) for k in self._get_index()]
+
+    def __repr__(self):
+        return "%s(%d keys)" % (self.__class__.__name__, len(self))
+
+class MappedArray(_MappedValue):
+    def __init__(self, parser, obj_refs, path):
+        self._parser = parser
+        self._obj_refs = obj_refs
+        self._path = path
+        self._value = _undefined
+
+    def _build(self):
+        return [_materialize(x) for x in self]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self._parser._read_object(self._obj_refs[index], self._path + (index,))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __len__(self):
+        return len(self._obj_refs)
+
+    def __repr__(self):
+        return "%s(%d items)" % (self.__class__.__name__, len(self))
+
 def _count_to_size(count):
     if count < 1 << 8:
         return 1
@@ -485,30 +1314,41 @@ class _BinaryPlistWriter (object):
         self._objtable = {}
         self._objidtable = {}
 
+        # Mapping of id(container) -> list of child objects in write order
+        self._children = {}
+
         # Create list of all objects in the plist
         self._flatten(value)
 
         # Size of object references in serialized containers
         # depends on the number of objects in the plist.
         num_objects = len(self._objlist)
-        self._object_offsets = [0]*num_objects
         self._ref_size = _count_to_size(num_objects)
 
         self._ref_format = _BINARY_FORMAT[self._ref_size]
 
-        # Write file header
-        self._fp.write(b'bplist00')
-
-        # Write object list
+        # Encode objects into a buffer of chunks that gets written out in
+        # ~1MiB batches, tracking offsets as we go rather than asking the file
+        # for its position each time
+        chunks = [b'bplist00']
+        object_offsets = []
+        pos = pending = 8
         for obj in self._objlist:
-            self._write_object(obj)
-
-        # Write refnum->object offset table
+            object_offsets.append(pos)
+            data = self._encode_object(obj)
+            chunks.append(data)
+            pos += len(data)
+            pending += len(data)
+            if pending >= 1048576:
+                self._fp.write(b''.join(chunks))
+                chunks, pending = [], 0
+
+        # Pack the refnum->object offset table in one go
         top_object = self._getrefnum(value)
-        offset_table_offset = self._fp.tell()
+        offset_table_offset = pos
         offset_size = _count_to_size(offset_table_offset)
-        offset_format = '>' + _BINARY_FORMAT[offset_size] * num_objects
-        self._fp.write(struct.pack(offset_format, *self._object_offsets))
+        offset_format = '>%d%s' % (num_objects, _BINARY_FORMAT[offset_size])
+        chunks.append(struct.pack(offset_format, *object_offsets))
 
         # Write trailer
         sort_version = 0
@@ -516,173 +1356,160 @@ class _BinaryPlistWriter (object):
             sort_version, offset_size, self._ref_size, num_objects,
             top_object, offset_table_offset
         )
-        self._fp.write(struct.pack('>5xBBBQQQ', *trailer))
+        chunks.append(struct.pack('>5xBBBQQQ', *trailer))
+        self._fp.write(b''.join(chunks))
 
     def _flatten(self, value):
-        # First check if the object is in the object table, not used for
-        # containers to ensure that two subcontainers with the same contents
-        # will be serialized as distinct values.
-        if isinstance(value, _scalars):
-            if (type(value), value) in self._objtable:
-                return
-
-        elif hasattr(plistlib, "Data") and isinstance(value, plistlib.Data):
-            if (type(value.data), value.data) in self._objtable:
-                return
+        # Walks the tree depth-first with an explicit stack so deeply nested
+        # plists can't hit the recursion limit.  Objects are visited in the
+        # same order plistlib's recursive walk uses, so the output matches.
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            # First check if the object is in the object table, not used for
+            # containers to ensure that two subcontainers with the same contents
+            # will be serialized as distinct values.
+            if isinstance(value, _scalars):
+                key = (type(value), value)
+                if key in self._objtable:
+                    continue
+                self._objtable[key] = len(self._objlist)
+
+            elif _is_data(value):
+                key = (type(value.data), value.data)
+                if key in self._objtable:
+                    continue
+                self._objtable[key] = len(self._objlist)
+
+            elif id(value) in self._objidtable:
+                continue
 
-        elif id(value) in self._objidtable:
-            return
-
-        # Add to objectreference map
-        refnum = len(self._objlist)
-        self._objlist.append(value)
-        if isinstance(value, _scalars):
-            self._objtable[(type(value), value)] = refnum
-        elif hasattr(plistlib, "Data") and isinstance(value, plistlib.Data):
-            self._objtable[(type(value.data), value.data)] = refnum
-        else:
-            self._objidtable[id(value)] = refnum
-
-        # And finally recurse into containers
-        if isinstance(value, dict):
-            keys = []
-            values = []
-            items = value.items()
-            if self._sort_keys:
-                items = sorted(items)
-
-            for k, v in items:
-                if not isinstance(k, basestring):
-                    if self._skipkeys:
-                        continue
-                    raise TypeError("keys must be strings")
-                keys.append(k)
-                values.append(v)
-
-            for o in itertools.chain(keys, values):
-                self._flatten(o)
-
-        elif isinstance(value, (list, tuple)):
-            for o in value:
-                self._flatten(o)
+            else:
+                self._objidtable[id(value)] = len(self._objlist)
+
+            # Add to objectreference map
+            self._objlist.append(value)
+
+            # And finally queue up the contents of containers
+            if isinstance(value, dict):
+                keys = []
+                values = []
+                items = value.items()
+                if self._sort_keys:
+                    items = sorted(items)
+
+                for k, v in items:
+                    if not isinstance(k, basestring):
+                        if self._skipkeys:
+                            continue
+                        raise TypeError("keys must be strings")
+                    keys.append(k)
+                    values.append(v)
+
+                children = keys + values
+                self._children[id(value)] = children
+                stack.extend(reversed(children))
+
+            elif isinstance(value, (list, tuple)):
+                stack.extend(reversed(value))
 
     def _getrefnum(self, value):
         if isinstance(value, _scalars):
             return self._objtable[(type(value), value)]
-        elif hasattr(plistlib, "Data") and isinstance(value, plistlib.Data):
+        elif _is_data(value):
             return self._objtable[(type(value.data), value.data)]
         else:
             return self._objidtable[id(value)]
 
-    def _write_size(self, token, size):
+    def _pack_refs(self, values):
+        return struct.pack('>%d%s' % (len(values), self._ref_format), *[self._getrefnum(o) for o in values])
+
+    def _encode_size(self, token, size):
         if size < 15:
-            self._fp.write(struct.pack('>B', token | size))
+            return struct.pack('>B', token | size)
 
         elif size < 1 << 8:
-            self._fp.write(struct.pack('>BBB', token | 0xF, 0x10, size))
+            return struct.pack('>BBB', token | 0xF, 0x10, size)
 
         elif size < 1 << 16:
-            self._fp.write(struct.pack('>BBH', token | 0xF, 0x11, size))
+            return struct.pack('>BBH', token | 0xF, 0x11, size)
 
         elif size < 1 << 32:
-            self._fp.write(struct.pack('>BBL', token | 0xF, 0x12, size))
+            return struct.pack('>BBL', token | 0xF, 0x12, size)
 
         else:
-            self._fp.write(struct.pack('>BBQ', token | 0xF, 0x13, size))
+            return struct.pack('>BBQ', token | 0xF, 0x13, size)
 
-    def _write_object(self, value):
-        ref = self._getrefnum(value)
-        self._object_offsets[ref] = self._fp.tell()
+    def _encode_object(self, value):
         if value is None:
-            self._fp.write(b'\x00')
+            return b'\x00'
 
         elif value is False:
-            self._fp.write(b'\x08')
+            return b'\x08'
 
         elif value is True:
-            self._fp.write(b'\x09')
+            return b'\x09'
 
         elif isinstance(value, int):
             if value < 0:
                 try:
-                    self._fp.write(struct.pack('>Bq', 0x13, value))
+                    return struct.pack('>Bq', 0x13, value)
                 except struct.error:
                     raise OverflowError(value) # from None
             elif value < 1 << 8:
-                self._fp.write(struct.pack('>BB', 0x10, value))
+                return struct.pack('>BB', 0x10, value)
             elif value < 1 << 16:
-                self._fp.write(struct.pack('>BH', 0x11, value))
+                return struct.pack('>BH', 0x11, value)
             elif value < 1 << 32:
-                self._fp.write(struct.pack('>BL', 0x12, value))
+                return struct.pack('>BL', 0x12, value)
             elif value < 1 << 63:
-                self._fp.write(struct.pack('>BQ', 0x13, value))
+                return struct.pack('>BQ', 0x13, value)
             elif value < 1 << 64:
-                self._fp.write(binascii.unhexlify("14"+hex(value)[2:].rstrip("L").rjust(32,"0")))
+                return binascii.unhexlify("14"+hex(value)[2:].rstrip("L").rjust(32,"0"))
             else:
                 raise OverflowError(value)
 
         elif isinstance(value, float):
-            self._fp.write(struct.pack('>Bd', 0x23, value))
+            return struct.pack('>Bd', 0x23, value)
 
         elif isinstance(value, datetime.datetime):
             f = (value - datetime.datetime(2001, 1, 1)).total_seconds()
-            self._fp.write(struct.pack('>Bd', 0x33, f))
+            return struct.pack('>Bd', 0x33, f)
 
-        elif (_check_py3() and isinstance(value, (bytes, bytearray))) or (hasattr(plistlib, "Data") and isinstance(value, plistlib.Data)):
+        elif (_check_py3() and isinstance(value, (bytes, bytearray))) or _is_data(value):
             if not isinstance(value, (bytes, bytearray)):
                 value = value.data # Unpack it
-            self._write_size(0x40, len(value))
-            self._fp.write(value)
+            return self._encode_size(0x40, len(value)) + bytes(value)
 
         elif isinstance(value, basestring):
             try:
                 t = value.encode('ascii')
-                self._write_size(0x50, len(value))
+                return self._encode_size(0x50, len(value)) + t
             except UnicodeEncodeError:
                 t = value.encode('utf-16be')
-                self._write_size(0x60, len(t) // 2)
-            self._fp.write(t)
+                return self._encode_size(0x60, len(t) // 2) + t
 
         elif isinstance(value, UID) or (hasattr(plistlib,"UID") and isinstance(value, plistlib.UID)):
             if value.data < 0:
                 raise ValueError("UIDs must be positive")
             elif value.data < 1 << 8:
-                self._fp.write(struct.pack('>BB', 0x80, value))
+                return struct.pack('>BB', 0x80, value)
             elif value.data < 1 << 16:
-                self._fp.write(struct.pack('>BH', 0x81, value))
+                return struct.pack('>BH', 0x81, value)
             elif value.data < 1 << 32:
-                self._fp.write(struct.pack('>BL', 0x83, value))
+                return struct.pack('>BL', 0x83, value)
             # elif value.data < 1 << 64:
-            #    self._fp.write(struct.pack('>BQ', 0x87, value))
+            #    return struct.pack('>BQ', 0x87, value)
             else:
                 raise OverflowError(value)
 
         elif isinstance(value, (list, tuple)):
-            refs = [self._getrefnum(o) for o in value]
-            s = len(refs)
-            self._write_size(0xA0, s)
-            self._fp.write(struct.pack('>' + self._ref_format * s, *refs))
+            return self._encode_size(0xA0, len(value)) + self._pack_refs(value)
 
         elif isinstance(value, dict):
-            keyRefs, valRefs = [], []
-
-            if self._sort_keys:
-                rootItems = sorted(value.items())
-            else:
-                rootItems = value.items()
-
-            for k, v in rootItems:
-                if not isinstance(k, basestring):
-                    if self._skipkeys:
-                        continue
-                    raise TypeError("keys must be strings")
-                keyRefs.append(self._getrefnum(k))
-                valRefs.append(self._getrefnum(v))
-
-            s = len(keyRefs)
-            self._write_size(0xD0, s)
-            self._fp.write(struct.pack('>' + self._ref_format * s, *keyRefs))
-            self._fp.write(struct.pack('>' + self._ref_format * s, *valRefs))
+            # Keys and values were gathered (and sorted if needed) when flattening
+            children = self._children[id(value)]
+            return self._encode_size(0xD0, len(children) // 2) + self._pack_refs(children)
 
         else:
             raise TypeError(value)
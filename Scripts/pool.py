@@ -0,0 +1,105 @@
+import os, struct, mmap
+from Scripts import lock
+
+# Pool file layout:
+#   magic (4 bytes), record size (uint32), count (uint64), cursor (uint64),
+#   padding to 32 bytes, then count fixed-width records.
+#
+# Records are only ever appended, and never change once count covers them -
+# so the only shared state is the header, and checking out identities is a
+# single cursor bump while holding the lock.
+MAGIC  = b"GSP1"
+HEADER = struct.Struct(">4sLQQ")
+HEADER_SIZE = 32
+FIELDS = (
+    ("model",24),
+    ("serial",16),
+    ("board_serial",24),
+    ("uuid",36),
+    ("rom",12)
+)
+RECORD = struct.Struct(">"+"".join("{}s".format(size) for _, size in FIELDS))
+
+class IdentityPool:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = lock.FileLock(path+".lock")
+        self._f = None
+        self._map = None
+
+    def _open(self):
+        if self._f:
+            return
+        with self.lock:
+            if not os.path.exists(self.path) or not os.path.getsize(self.path):
+                with open(self.path,"wb") as f:
+                    f.write(HEADER.pack(MAGIC,RECORD.size,0,0).ljust(HEADER_SIZE,b"\x00"))
+        self._f = open(self.path,"r+b")
+        magic, size, _, _ = HEADER.unpack(self._f.read(HEADER.size))
+        if magic != MAGIC or size != RECORD.size:
+            self.close()
+            raise ValueError("Not a compatible identity pool: {}".format(self.path))
+        self._remap()
+
+    def _remap(self):
+        # Maps the whole file as it stands - done again whenever new records
+        # land past the end of our current map
+        if self._map:
+            self._map.close()
+        self._map = mmap.mmap(self._f.fileno(), 0)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    def _pack(self, record):
+        values = []
+        for (name, size), value in zip(FIELDS, record):
+            value = value.encode("utf-8") if not isinstance(value,bytes) else value
+            if len(value) > size:
+                raise ValueError("{} is too long for the pool: {}".format(name,value))
+            values.append(value)
+        return RECORD.pack(*values)
+
+    def _unpack(self, index):
+        offset = HEADER_SIZE+index*RECORD.size
+        if offset+RECORD.size > len(self._map):
+            self._remap()
+        return tuple(x.rstrip(b"\x00").decode("utf-8") for x in RECORD.unpack_from(self._map, offset))
+
+    def status(self):
+        # Returns a (cursor, count) tuple
+        self._open()
+        _, _, count, cursor = HEADER.unpack_from(self._map, 0)
+        return (cursor, count)
+
+    def fill(self, records):
+        # Appends records (model, serial, board serial, uuid, rom) to the pool,
+        # and returns the new total
+        self._open()
+        data = b"".join(self._pack(r) for r in records)
+        with self.lock:
+            _, _, count, cursor = HEADER.unpack_from(self._map, 0)
+            self._f.seek(HEADER_SIZE+count*RECORD.size)
+            self._f.write(data)
+            self._f.flush()
+            count += len(data)//RECORD.size
+            # Only publish the new count once the records are in place
+            struct.pack_into(">Q", self._map, 8, count)
+            self._map.flush()
+        return count
+
+    def checkout(self, count = 1):
+        # Claims up to count unused identities and returns them as a list of
+        # (model, serial, board serial, uuid, rom) tuples
+        self._open()
+        with self.lock:
+            _, _, total, cursor = HEADER.unpack_from(self._map, 0)
+            take = max(0,min(count,total-cursor))
+            struct.pack_into(">Q", self._map, 16, cursor+take)
+        return [self._unpack(i) for i in range(cursor, cursor+take)]
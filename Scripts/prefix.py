@@ -0,0 +1,120 @@
+import os, sys, json, struct, binascii, mmap
+try:
+    from secrets import randbelow
+except ImportError:
+    from random import SystemRandom
+    randbelow = SystemRandom().randrange
+
+# Compiled table layout:
+#   magic (4 bytes), count (uint32), JSON size (uint64), JSON mtime (double)
+#   count sorted 3-byte OUIs
+MAGIC  = b"OUI1"
+HEADER = struct.Struct(">4sLQd")
+
+class PrefixTable:
+
+    def __init__(self, json_path, bin_path = None):
+        # Loads the sorted, packed OUI table compiled from json_path - building
+        # (or rebuilding) it first if it's missing or the JSON has changed since
+        self.json_path = json_path
+        self.bin_path = bin_path or os.path.splitext(json_path)[0]+".bin"
+        self._data = b""
+        self._count = 0
+        try:
+            self._load()
+        except Exception:
+            pass
+
+    def _json_stat(self):
+        st = os.stat(self.json_path)
+        return (st.st_size, st.st_mtime)
+
+    def _compile(self):
+        # Returns the packed table bytes for the current JSON
+        size, mtime = self._json_stat()
+        prefixes = json.load(open(self.json_path))
+        ouis = set()
+        for p in prefixes if isinstance(prefixes,list) else []:
+            try:
+                oui = binascii.unhexlify(p.encode("utf-8") if not isinstance(p,bytes) else p)
+            except Exception:
+                continue
+            if len(oui) == 3:
+                ouis.add(oui)
+        ouis = sorted(ouis)
+        return HEADER.pack(MAGIC, len(ouis), size, mtime) + b"".join(ouis)
+
+    def _load(self):
+        size, mtime = self._json_stat()
+        data = None
+        try:
+            with open(self.bin_path,"rb") as f:
+                header = f.read(HEADER.size)
+                magic, count, bin_size, bin_mtime = HEADER.unpack(header)
+                if magic == MAGIC and bin_size == size and bin_mtime == mtime and os.fstat(f.fileno()).st_size == HEADER.size + count*3:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            pass
+        if data is None:
+            # Missing or stale - rebuild it, and save it if we can
+            data = self._compile()
+            try:
+                from Scripts import writer
+                writer.atomic_write(self.bin_path, data, fsync="none")
+            except Exception:
+                pass
+        self._data = data
+        self._count = HEADER.unpack(data[:HEADER.size])[1]
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+    __nonzero__ = __bool__
+
+    def _oui(self, index):
+        start = HEADER.size + index*3
+        return self._data[start:start+3]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("prefix index out of range")
+        return binascii.hexlify(self._oui(index)).decode("utf-8").upper()
+
+    def __iter__(self):
+        return (self[i] for i in range(self._count))
+
+    def __contains__(self, value):
+        # Binary search for the first 3 bytes of value - which can be a hex
+        # string (prefix or full ROM) or raw bytes
+        if isinstance(value,bytearray) or (sys.version_info >= (3,0) and isinstance(value,bytes)):
+            value = bytes(value[:3])
+        else:
+            try: value = binascii.unhexlify(value[:6])
+            except Exception: return False
+        if len(value) != 3:
+            return False
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo+hi)//2
+            oui = self._oui(mid)
+            if oui < value:
+                lo = mid+1
+            elif oui > value:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def is_apple(self, rom):
+        # Returns whether the passed ROM starts with one of our prefixes
+        return rom in self
+
+    def choice(self):
+        # Returns a random prefix as an uppercase hex string
+        if not self._count:
+            raise IndexError("Cannot choose from an empty prefix table")
+        return self[randbelow(self._count)]
@@ -80,7 +80,7 @@ class Run:
             return value.decode(encoding,errors)
         return value
 
-    def _run_command(self, comm, shell = False):
+    def _run_command(self, comm, shell = False, raw = False):
         c = None
         try:
             if shell and type(comm) is list:
@@ -92,6 +92,9 @@ class Run:
         except:
             if c == None:
                 return ("", "Command not found!", 1)
+        if raw:
+            # Leave the output as bytes for callers that parse it themselves
+            return (c[0], c[1], p.returncode)
         return (self._decode(c[0]), self._decode(c[1]), p.returncode)
 
     def run(self, command_list, leave_on_fail = False):
@@ -109,6 +112,7 @@ class Run:
             stderr = comm.get("stderr", False)
             mess   = comm.get("message", None)
             show   = comm.get("show",   False)
+            raw    = comm.get("raw",    False)
             
             if not mess == None:
                 print(mess)
@@ -134,7 +138,7 @@ class Run:
                 out = self._stream_output(args, shell)
             else:
                 # Just run and gather output
-                out = self._run_command(args, shell)
+                out = self._run_command(args, shell, raw)
                 if stdout and len(out[0]):
                     print(out[0])
                 if stderr and len(out[1]):
@@ -0,0 +1,153 @@
+import re, sys, datetime
+
+# Native decoding of the date/plant fields Apple encodes in serials and MLBs -
+# based on the layouts macserial itself uses.  Model names aren't derivable from
+# the serial alone, so those still need macserial's tables (see parse_info).
+BASE34 = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ" # No I or O
+YEARS  = "CDFGHJKLMNPQRSTVWXYZ"               # Two letters per year from 2010 - first/second half
+WEEKS  = "123456789CDFGHJKLMNPQRTVWXY"        # Week within the half year
+
+# Record layout produced by parse_smbios()
+SMBIOS_FIELDS = ("model","serial","board_serial")
+
+# year is only set when the identifier pins down the decade - years lists
+# every candidate (i.e. "2013/2023") either way
+FIELDS = ("identifier","kind","valid","plant","year","years","week","model","error")
+
+# The 11 character serials and 13 character MLBs were phased out by 2012, and
+# their year digit only goes back to 2003 - so 0-2 can only mean 2010-2012
+LEGACY_FIRST_YEAR = 2003
+
+def kind_of(identifier):
+    # Guesses whether identifier is a system serial or an MLB from its length
+    return "serial" if len(identifier) in (11,12) else "mlb" if len(identifier) in (13,17) else None
+
+def _legacy_year(digit):
+    year = 2000 + digit
+    return year + 10 if year < LEGACY_FIRST_YEAR else year
+
+def _set_years(info, first, legacy = False):
+    # The current year codes repeat every decade - every match from first up
+    # to this year is a candidate.  Legacy ones never made it to a second.
+    years = [first]
+    while not legacy and years[-1] + 10 <= datetime.date.today().year:
+        years.append(years[-1] + 10)
+    info["year"] = years[0] if len(years) == 1 else None
+    info["years"] = "/".join(str(y) for y in years)
+
+def resolve_year(info, text):
+    # Settles an ambiguous year with the one macserial reported (the "Year:"
+    # line of -i/-mi output, i.e. "C - 2010") if it's one of our candidates
+    m = re.search(r"\b(\d{4})\s*$", text or "")
+    if m and info.get("years") and m.group(1) in info["years"].split("/"):
+        info["year"] = int(m.group(1))
+    return info
+
+def _week(value):
+    try: week = int(value)
+    except ValueError: return None
+    return week if 1 <= week <= 53 else None
+
+def decode_serial(serial):
+    # Returns a dict of the decoded fields, with valid set to whether every
+    # field is well formed
+    serial = serial.strip().upper()
+    info = {"identifier":serial,"kind":"serial","valid":False,"plant":None,"year":None,"years":None,"week":None,"model":None,"error":None}
+    if any(c not in BASE34 for c in serial):
+        info["error"] = "invalid characters"
+    elif len(serial) == 12:
+        info["plant"] = serial[:3]
+        y, w = YEARS.find(serial[3]), WEEKS.find(serial[4])
+        if y < 0:
+            info["error"] = "invalid year"
+        elif w < 0:
+            info["error"] = "invalid week"
+        else:
+            _set_years(info, 2010 + y//2)
+            info["week"] = w + 1 + (26 if y % 2 else 0)
+            info["valid"] = True
+    elif len(serial) == 11:
+        # Legacy - year digit and two-digit week
+        info["plant"] = serial[:2]
+        week = _week(serial[3:5])
+        if not serial[2].isdigit():
+            info["error"] = "invalid year"
+        elif week is None:
+            info["error"] = "invalid week"
+        else:
+            _set_years(info, _legacy_year(int(serial[2])), legacy=True)
+            info["week"] = week
+            info["valid"] = True
+    else:
+        info["error"] = "invalid length"
+    return info
+
+def decode_mlb(mlb):
+    # Same as decode_serial() for board serials - the year is a single digit,
+    # followed by a two-digit week.  13 character MLBs share the legacy
+    # serials' decade, 17 character ones started in 2010.
+    mlb = mlb.strip().upper()
+    info = {"identifier":mlb,"kind":"mlb","valid":False,"plant":None,"year":None,"years":None,"week":None,"model":None,"error":None}
+    if any(c not in BASE34 for c in mlb):
+        info["error"] = "invalid characters"
+    elif len(mlb) in (13,17):
+        info["plant"] = mlb[:3]
+        week = _week(mlb[4:6])
+        if not mlb[3].isdigit():
+            info["error"] = "invalid year"
+        elif week is None:
+            info["error"] = "invalid week"
+        else:
+            if len(mlb) == 13:
+                _set_years(info, _legacy_year(int(mlb[3])), legacy=True)
+            else:
+                _set_years(info, 2010 + int(mlb[3]))
+            info["week"] = week
+            info["valid"] = True
+    else:
+        info["error"] = "invalid length"
+    return info
+
+def decode(identifier, kind = None):
+    kind = kind or kind_of(identifier.strip())
+    return decode_mlb(identifier) if kind == "mlb" else decode_serial(identifier)
+
+def parse_info(text):
+    # Parses the "Key: value" lines from macserial -i/-mi output into a dict
+    # with lowercased keys
+    info = {}
+    for line in text.split("\n"):
+        m = re.match(r"^\s*([A-Za-z][A-Za-z ]*?):\s+(.*\S)\s*$", line)
+        if m:
+            info[m.group(1).strip().lower()] = m.group(2)
+    return info
+
+def parse_info_blocks(text):
+    # Same as parse_info() for output covering several identifiers - a new
+    # dict starts whenever a key comes around again
+    blocks = []
+    for line in text.split("\n"):
+        m = re.match(r"^\s*([A-Za-z][A-Za-z ]*?):\s+(.*\S)\s*$", line)
+        if not m:
+            continue
+        key = m.group(1).strip().lower()
+        if not blocks or key in blocks[-1]:
+            blocks.append({})
+        blocks[-1][key] = m.group(2)
+    return blocks
+
+# One macserial -a record per line: "model | serial | board serial", padded
+# with spaces.  Lines that don't have exactly three fields, or that start
+# with ERROR, don't match.
+_SMBIOS_PATTERN = r"^(?![ \t]*ERROR)[ \t]*([^\s|]+)[ \t]*\|[ \t]*([^\s|]+)[ \t]*\|[ \t]*([^\s|]+)[ \t]*\r?$"
+_SMBIOS_BYTES = re.compile(_SMBIOS_PATTERN.encode("ascii"), re.M)
+_SMBIOS_TEXT = re.compile(_SMBIOS_PATTERN, re.M)
+
+def parse_smbios(data):
+    # Single pass over raw macserial -a output - matches the records straight
+    # out of the bytes (or text) and returns a list of (model, serial, board
+    # serial) tuples
+    if not isinstance(data, bytes) or sys.version_info < (3,0):
+        return [tuple(f) for f in _SMBIOS_TEXT.findall(data)]
+    # Only the matched fields get decoded - they're all ASCII
+    return [(m.decode("latin-1"),s.decode("latin-1"),b.decode("latin-1")) for m, s, b in _SMBIOS_BYTES.findall(data)]
@@ -0,0 +1,187 @@
+import os, sys, json, signal, threading
+from collections import deque
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    import socketserver
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    import SocketServer as socketserver
+    from urlparse import urlparse, parse_qs
+
+FIELDS = ("model","serial","board_serial","uuid","rom")
+MAX_COUNT = 10000 # Largest count a single request can ask for
+
+class IdentityBuffer:
+
+    def __init__(self, generate, size = 100, models = (), batch = 20):
+        # Keeps up to size ready-made identities per model, topped up in the
+        # background by calling generate(model, count) - which should return a
+        # list of (model, serial, board serial, uuid, rom) records, or None/False
+        # on failure
+        self.generate = generate
+        self.size = size
+        self.batch = batch
+        self.buffers = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self._stop = False
+        for model in models:
+            self.buffers[model.lower()] = deque()
+        self.thread = threading.Thread(target=self._refill_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        self.wake.set()
+
+    def _refill_loop(self):
+        while not self._stop:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                models = list(self.buffers)
+            for model in models:
+                while not self._stop:
+                    # take() can drop a model at any point - skip it if so
+                    with self.lock:
+                        buf = self.buffers.get(model)
+                        want = 0 if buf is None else self.size-len(buf)
+                    if want <= 0:
+                        break
+                    records = self.generate(model, min(self.batch, want))
+                    if not records:
+                        # Don't keep hammering a model macserial won't generate
+                        self.errors[model] = records
+                        with self.lock:
+                            self.buffers.pop(model, None)
+                        break
+                    with self.lock:
+                        buf = self.buffers.get(model)
+                        if buf is None:
+                            break
+                        buf.extend(tuple(r) for r in records)
+
+    def stop(self):
+        self._stop = True
+        self.wake.set()
+
+    def take(self, model, count):
+        # Returns count identities for model - from the buffer where we can,
+        # generating the rest on the spot.  Raises ValueError if the model can't
+        # be generated.
+        key = model.lower()
+        with self.lock:
+            buf = self.buffers.setdefault(key, deque())
+            out = [buf.popleft() for _ in range(min(count, len(buf)))]
+        if len(out) < count:
+            records = self.generate(model, count-len(out))
+            if records is None:
+                raise ValueError("macserial returned an error")
+            elif not records:
+                with self.lock:
+                    self.buffers.pop(key, None)
+                raise ValueError("{} not generated by macserial".format(model))
+            out.extend(tuple(r) for r in records)
+        # Let the refill thread top us back up
+        self.wake.set()
+        return out
+
+    def status(self):
+        with self.lock:
+            return dict((m, len(b)) for m, b in self.buffers.items())
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set per server in serve()
+    service = None
+
+    def log_message(self, format, *args):
+        # Keep quiet - this runs unattended
+        pass
+
+    def address_string(self):
+        # Unix sockets don't have a client address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def _send(self, code, value):
+        data = json.dumps(value).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            count = int(query.get("count",["1"])[0])
+            assert 0 < count <= MAX_COUNT
+        except Exception:
+            return self._send(400, {"error":"count must be between 1 and {}".format(MAX_COUNT)})
+        s = self.service
+        if url.path == "/identities":
+            model = query.get("model",[None])[0]
+            if not model:
+                return self._send(400, {"error":"model is required"})
+            try:
+                records = s["buffer"].take(model, count)
+            except ValueError as e:
+                return self._send(404, {"error":str(e)})
+            return self._send(200, [dict(zip(FIELDS, r)) for r in records])
+        elif url.path == "/uuid":
+            return self._send(200, s["uuids"](count))
+        elif url.path == "/rom":
+            return self._send(200, s["roms"](count))
+        elif url.path == "/status":
+            return self._send(200, {"buffered":s["buffer"].status(),"buffer_size":s["buffer"].size})
+        self._send(404, {"error":"unknown endpoint"})
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    # No Unix sockets here (i.e. Windows)
+    _UnixServer = None
+
+def serve(service, host = "127.0.0.1", port = 8765, socket_path = None):
+    # Serves the passed service dict - {"buffer":IdentityBuffer, "uuids":func,
+    # "roms":func} - over localhost HTTP, or HTTP over a Unix socket if
+    # socket_path is set.  Blocks until interrupted.
+    handler = type("Handler", (_Handler,), {"service":service})
+    if socket_path:
+        if _UnixServer is None:
+            raise ValueError("Unix sockets are not supported on this platform")
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # Create the socket owner-only from the start - chmod after bind would
+        # leave a window where anyone could connect
+        umask = os.umask(0o177)
+        try:
+            server = _UnixServer(socket_path, handler)
+        finally:
+            os.umask(umask)
+        print("Serving on unix:{}".format(socket_path))
+    else:
+        server = _TCPServer((host, port), handler)
+        print("Serving on http://{}:{}".format(host, server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        # Shut down cleanly when we're asked to stop
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    except ValueError:
+        # Not the main thread
+        pass
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service["buffer"].stop()
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
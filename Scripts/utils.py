@@ -7,10 +7,98 @@ else:
     # Not Windows \o/
     import select
 
+def _rows(line, width):
+    # Number of terminal rows line takes up once wrapped - None is a line we
+    # don't know the contents of, so it's assumed to fill a row
+    return 1 if not line else max(1, (len(line)-1)//width+1)
+
+class _Frame:
+    # Stands in for sys.stdout while Utils draws a screen.  The cursor starts at
+    # the top left, and each line is compared against whatever the last frame
+    # drew on that row - matches are skipped with a newline, anything else is
+    # written over the old row and the remainder cleared.  Once a change wraps
+    # to a different number of rows than the line it replaced, the rows below
+    # no longer line up and everything after it is redrawn.  Frames taller
+    # than the terminal scroll, so past that point we just pass writes along.
+
+    def __init__(self, stream, previous, width, height):
+        self.stream = stream
+        self.previous = previous
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.lines = []
+        self.partial = "" # Text of the current line so far
+        self.unsent = ""  # Any of that we haven't written yet
+        self.pending = [] # Output held until the next flush()
+        self.shifted = False
+
+    def _line(self, line, unsent):
+        index = len(self.lines)
+        self.lines.append(line)
+        self.rows += _rows(line, self.width)
+        old = self.previous[index] if index < len(self.previous) else None
+        if not self.shifted and old == line and unsent == line:
+            # Identical - just step over it
+            return "\n"*_rows(line, self.width)
+        if old is not None and _rows(old, self.width) != _rows(line, self.width):
+            self.shifted = True
+        return unsent+"\033[K\n"
+
+    def send(self, data):
+        self.pending.append(data)
+
+    def write(self, data):
+        if self.lines is None:
+            return self.send(data)
+        parts = data.split("\n")
+        out = []
+        for part in parts[:-1]:
+            out.append(self._line(self.partial+part, self.unsent+part))
+            self.partial = self.unsent = ""
+        self.partial += parts[-1]
+        self.unsent += parts[-1]
+        if self.rows >= self.height:
+            # Scrolling now - nothing to diff against next time
+            self.lines = None
+            out.append(self.unsent)
+            self.unsent = ""
+        if out:
+            self.send("".join(out))
+
+    def writelines(self, lines):
+        self.write("".join(lines))
+
+    def flush(self, tail = ""):
+        # Writes out everything held so far in one go, followed by tail.
+        # Partial lines are written as-is - and redrawn in full when finished.
+        out = "".join(self.pending)+self.unsent+tail
+        self.pending = []
+        self.unsent = ""
+        if out:
+            self.stream.write(out)
+        self.stream.flush()
+
+    def redraw(self):
+        # Something else is about to draw on the screen (i.e. a download's
+        # progress bar) - get our output up first, then stop diffing so the
+        # next frame starts from a clean screen
+        self.flush()
+        self.lines = None
+
+    def __getattr__(self, attr):
+        # fileno(), isatty(), encoding, etc
+        return getattr(self.stream, attr)
+
 class Utils:
 
     def __init__(self, name = "Python Script"):
         self.name = name
+        # Whether cls() draws with escape sequences - decided on first use
+        self.ansi = None
+        self._last_frame = None
+        # Scripted answers for grab() - see replay()
+        self.answers = None
         # Init our colors before we need to print anything
         cwd = os.getcwd()
         os.chdir(os.path.dirname(os.path.realpath(__file__)))
@@ -133,11 +221,48 @@ class Utils:
             # Maybe we have escapes to handle?
             test_path = "\\".join([x.replace("\\", "") for x in test_path.split("\\\\")])
 
+    def replay(self, source):
+        # Answers grab() prompts from source - a file path, "-" for stdin, or
+        # any iterable of lines - one line per prompt, as fast as they're asked.
+        # Timed prompts take their default without using up a line.  Once the
+        # answers run out we go back to the keyboard if there is one, and quit
+        # otherwise.
+        if source == "-":
+            source = sys.stdin
+        elif isinstance(source, (str, type(u""))):
+            with open(source) as f:
+                source = f.readlines()
+        self.answers = iter(source)
+
+    def _next_answer(self, prompt):
+        try:
+            answer = next(self.answers)
+        except StopIteration:
+            self.answers = None
+            if not sys.stdin.isatty():
+                # Nobody to ask
+                print("")
+                exit(0)
+            return None
+        answer = answer.rstrip("\r\n")
+        # Echo it so the session reads like it was typed
+        sys.stdout.write(prompt+answer+"\n")
+        sys.stdout.flush()
+        return answer
+
     def grab(self, prompt, **kwargs):
         # Takes a prompt, a default, and a timeout and shows it with that timeout
         # returning the result
         timeout = kwargs.get("timeout", 0)
         default = kwargs.get("default", None)
+        # Wrap up any menu we're drawing before asking
+        self.end_frame()
+        if self.answers is not None:
+            if timeout > 0:
+                return default
+            answer = self._next_answer(prompt)
+            if answer is not None:
+                return answer
         # If we don't have a timeout - then skip the timed sections
         if timeout <= 0:
             if sys.version_info >= (3, 0):
@@ -169,8 +294,65 @@ class Utils:
         else:
             return default
 
+    def _ansi_supported(self):
+        # Only draw with escapes when we're talking to a terminal that
+        # understands them
+        stream = sys.__stdout__
+        try:
+            if not stream.isatty() or os.environ.get("TERM","").lower() == "dumb":
+                return False
+        except Exception:
+            return False
+        if os.name != "nt":
+            return True
+        # Windows 10+ consoles need virtual terminal processing turned on
+        try:
+            kernel32 = ctypes.windll.kernel32
+            handle = kernel32.GetStdHandle(-11) # STD_OUTPUT_HANDLE
+            mode = ctypes.c_uint32()
+            if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+                return False
+            return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004)) # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        except Exception:
+            return False
+
+    def _terminal_size(self):
+        try:
+            size = os.get_terminal_size(sys.__stdout__.fileno())
+            return (size.columns or 80, size.lines or 24)
+        except Exception:
+            # Python 2, or not a terminal
+            return (80, 24)
+
+    def end_frame(self):
+        # Finishes the frame started by cls() - clears anything left below it
+        # from the last one and hands stdout back.  Safe to call when no frame
+        # is being drawn.
+        frame = sys.stdout
+        if not isinstance(frame, _Frame):
+            return
+        frame.flush("\033[J")
+        sys.stdout = frame.stream
+        self._last_frame = None if frame.lines is None else frame.lines + ([None] if frame.partial else [])
+
     def cls(self):
-    	os.system('cls' if os.name=='nt' else 'clear')
+        if self.ansi is None:
+            self.ansi = self._ansi_supported()
+        if not self.ansi:
+            os.system('cls' if os.name=='nt' else 'clear')
+            return
+        self.end_frame()
+        width, height = self._terminal_size()
+        previous = self._last_frame
+        # Diffing relies on the last frame (plus the prompt under it) still
+        # being on screen where we drew it - if it could have scrolled, start
+        # over with a real clear
+        if previous is None or sum(_rows(x, width) for x in previous)+1 >= height:
+            sys.stdout.write("\033[H\033[2J")
+            previous = []
+        else:
+            sys.stdout.write("\033[H")
+        sys.stdout = _Frame(sys.stdout, previous, width, height)
 
     def cprint(self, message, **kwargs):
         strip_colors = kwargs.get("strip_colors", False)
@@ -237,6 +419,7 @@ class Utils:
 
     def custom_quit(self):
         self.head()
+        self.end_frame()
         print("by CorpNewt\n")
         print("Thanks for testing it out, for bugs/comments/complaints")
         print("send me a message on Reddit, or check out my GitHub:\n")
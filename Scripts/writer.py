@@ -0,0 +1,116 @@
+import os
+from io import BytesIO
+from collections import OrderedDict
+from Scripts import lock, plist
+
+FSYNC_POLICIES = ("none","file","full")
+
+def atomic_write(path, data, fsync = "file", mode = None):
+    # Writes data to a temp file next to path, then swaps it into place so
+    # readers only ever see the old or the new contents - never a partial file.
+    # mode sets the new file's permissions - otherwise they're carried over
+    # from the file being replaced.
+    #
+    # fsync can be one of:
+    #  none = leave flushing to the OS
+    #  file = fsync the temp file before it replaces the target
+    #  full = also fsync the containing directory after the replace (POSIX)
+    if not fsync in FSYNC_POLICIES:
+        raise ValueError("Unknown fsync policy: {}".format(fsync))
+    path = os.path.abspath(path)
+    folder = os.path.dirname(path)
+    import tempfile # Only needed once we actually write
+    fd, temp = tempfile.mkstemp(dir=folder, prefix=".{}.".format(os.path.basename(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+            f.flush()
+            if fsync != "none":
+                os.fsync(f.fileno())
+        # Keep the original file's permissions if it exists - otherwise use
+        # what a normal open() would have given us
+        if mode is None:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except OSError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+        try: os.chmod(temp, mode)
+        except OSError: pass
+        if hasattr(os,"replace"):
+            os.replace(temp, path)
+        else:
+            # Python 2 - rename is atomic on POSIX, but Windows won't
+            # rename over an existing file
+            if os.name == "nt" and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+    except:
+        try: os.remove(temp)
+        except OSError: pass
+        raise
+    if fsync == "full" and os.name != "nt":
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+
+class WriteBehind:
+
+    def __init__(self, fsync = "file", lock_dir = None):
+        # Holds pending plist edits per path until flush() is called, at which
+        # point each path gets exactly one atomic write no matter how many
+        # edits were queued for it.  With a lock_dir, each write holds an
+        # advisory lock (see lock.lock_for()) so parallel instances patching
+        # the same file take turns instead of losing each other's edits.
+        self.fsync = fsync if fsync in FSYNC_POLICIES else "file"
+        self.lock_dir = lock_dir
+        self.pending = OrderedDict()
+
+    def queue(self, path, value, changes = None, dirty = False):
+        # value is the full plist data for path, and changes is a dict of key
+        # path -> new value that can be patched into the file in place.  dirty
+        # means value has diverged from the file beyond those changes.
+        path = os.path.abspath(path)
+        entry = self.pending.setdefault(path,{"value":None,"changes":OrderedDict(),"dirty":False})
+        entry["value"] = value
+        entry["dirty"] = entry["dirty"] or dirty or not changes
+        if changes:
+            entry["changes"].update(changes)
+
+    def discard(self, path):
+        # Drops anything pending for path - i.e. the edits were undone
+        self.pending.pop(os.path.abspath(path), None)
+
+    def _render(self, path, entry):
+        # Returns the bytes to write for the passed pending entry - splicing the
+        # changes into the current file if we can, or dumping the whole plist
+        if not entry["dirty"] and entry["changes"]:
+            try:
+                with open(path,"rb") as f:
+                    return plist.patches(f.read(), entry["changes"])
+            except Exception:
+                # Binary plist, missing keys, etc - fall back on a full dump
+                pass
+        data = BytesIO()
+        plist.dump(entry["value"], data, sort_keys=False)
+        return data.getvalue()
+
+    def flush(self, path = None):
+        # Writes out everything pending - or just path if passed.  Returns the
+        # list of paths written.
+        paths = list(self.pending) if path is None else [os.path.abspath(path)]
+        written = []
+        for p in paths:
+            entry = self.pending.get(p)
+            if entry is None:
+                continue
+            if self.lock_dir:
+                # Only the read (for patching) and the replace are covered
+                with lock.lock_for(p, self.lock_dir):
+                    atomic_write(p, self._render(p, entry), fsync=self.fsync)
+            else:
+                atomic_write(p, self._render(p, entry), fsync=self.fsync)
+            self.pending.pop(p,None)
+            written.append(p)
+        return written
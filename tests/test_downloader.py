@@ -0,0 +1,95 @@
+import os, sys, re, shutil, tempfile, threading, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Scripts import downloader
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+BODY = bytes(bytearray(i*7 % 251 for i in range(256*1024)))
+CUT = 48*1024 # Bytes sent before a dropped connection gives up
+
+class _Handler(BaseHTTPRequestHandler):
+    # Serves BODY, honouring "Range: bytes=N-" - the first server.drops
+    # responses stop CUT bytes into the body and close the connection
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start = 0
+        m = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        if m:
+            start = int(m.group(1))
+            self.server.ranges.append(start)
+        body = BODY[start:]
+        self.send_response(206 if m else 200)
+        if m:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(BODY)-1, len(BODY)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.drops:
+            self.server.drops -= 1
+            body = body[:CUT]
+        try:
+            self.wfile.write(body)
+        except (OSError, IOError):
+            pass # The client hung up first
+        self.close_connection = True
+
+class _CountingDownloader(downloader.Downloader):
+    def __init__(self, **kwargs):
+        downloader.Downloader.__init__(self, **kwargs)
+        self.attempts = 0
+
+    def stream_to_file(self, *args, **kwargs):
+        self.attempts += 1
+        return downloader.Downloader.stream_to_file(self, *args, **kwargs)
+
+class DownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.drops = 0
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/macserial.zip".format(self.server.server_address[1])
+        self.temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp, "macserial.zip")
+        self.d = _CountingDownloader(backoff=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def test_resumes_after_dropped_connections(self):
+        self.server.drops = 2
+        self.assertEqual(self.d.download(self.url, self.path, progress=False, retries=4), self.path)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), BODY)
+        # Every attempt past the first opens with a plain request that's only
+        # read for its size, which can use up one of the drops
+        self.assertTrue(1 < self.d.attempts <= 3)
+        # The retries picked up where the file left off
+        self.assertTrue(self.server.ranges)
+        self.assertEqual(self.server.ranges[0], CUT)
+
+    def test_retries_are_bounded(self):
+        self.server.drops = 1000
+        self.assertIsNone(self.d.download(self.url, self.path, progress=False, retries=2))
+        self.assertEqual(self.d.attempts, 3)
+
+    def test_replaces_existing_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"stale")
+        self.assertEqual(self.d.download(self.url, self.path, progress=False, retries=0), self.path)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), BODY)
+
+if __name__ == "__main__":
+    unittest.main()
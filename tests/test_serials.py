@@ -0,0 +1,73 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Scripts import serials
+
+# Trimmed macserial -i/-mi output for the identifiers below - the year each
+# one settles on is the one macserial reports
+MACSERIAL_INFO = {
+    "W80123456AB": """
+       Country:  W8 - China (Shanghai)
+          Year:  0 - 2010
+          Week:  12 - 12
+         Model:  56AB - MacBookPro7,1
+         Valid:  Possibly
+""",
+    "W87123456AB": """
+       Country:  W8 - China (Shanghai)
+          Year:  7 - 2007
+          Week:  12 - 12
+         Model:  56AB - MacBookPro3,1
+         Valid:  Possibly
+""",
+    "C02N6L5KRX13": """
+       Country:  C02 - China (Quanta Computer)
+          Year:  N - 2014
+          Week:  K - 32
+         Model:  KRX13 - MacBookPro11,1
+         Valid:  Possibly
+""",
+    "C023456789ABCDEFG": """
+       Country:  C02 - China (Quanta Computer)
+          Year:  3 - 2023
+          Week:  45 - 45
+         Valid:  Possibly
+""",
+}
+
+class DecodeYearTests(unittest.TestCase):
+
+    def test_legacy_serial_decade(self):
+        # 0-2 are 2010-2012, not 2000-2002
+        for serial, year in (("W80123456AB",2010),("W82123456AB",2012),("W83123456AB",2003),("W87123456AB",2007)):
+            info = serials.decode(serial)
+            self.assertTrue(info["valid"])
+            self.assertEqual(info["year"], year)
+            self.assertEqual(info["years"], str(year))
+
+    def test_legacy_mlb_decade(self):
+        self.assertEqual(serials.decode("C02012345678F")["year"], 2010)
+        self.assertEqual(serials.decode("C02712345678F")["year"], 2007)
+
+    def test_ambiguous_years(self):
+        # The current year codes have come around again since 2020
+        mlb = serials.decode("C023456789ABCDEFG")
+        self.assertIsNone(mlb["year"])
+        self.assertEqual(mlb["years"].split("/")[:2], ["2013","2023"])
+        serial = serials.decode("C02N6L5KRX13")
+        self.assertIsNone(serial["year"])
+        self.assertEqual(serial["years"].split("/")[:2], ["2014","2024"])
+        self.assertEqual(serial["week"], 32)
+
+    def test_matches_macserial(self):
+        for identifier, text in MACSERIAL_INFO.items():
+            fields = serials.parse_info(text)
+            info = serials.resolve_year(serials.decode(identifier), fields.get("year"))
+            self.assertEqual(info["year"], int(fields["year"].split()[-1]), identifier)
+
+    def test_resolve_ignores_other_years(self):
+        info = serials.resolve_year(serials.decode("C023456789ABCDEFG"), "3 - 2003")
+        self.assertIsNone(info["year"])
+
+if __name__ == "__main__":
+    unittest.main()